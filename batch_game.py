@@ -0,0 +1,252 @@
+from solitaire import (VALUES, SUITS, NUM_PLAY_PILES, KING_RANK, TO_BLOCK, TO_PILE, DEAL_CARDS,
+                       MAX_RUN, ACTION_MOVES, N_ACTIONS, DEFAULT_RULES, CARD_RANK, CARD_SUIT, CAN_STACK,
+                       STACKS_ON)
+import numpy as np
+
+# Runs N games of solitaire in lockstep, with the whole batch stored as
+# numpy arrays. Moves are the fixed action ids of solitaire.ACTION_MOVES and
+# follow the rules of Game.do_move / Game.get_valid_moves (without the
+# visited-state penalty of Game.step), under the default RuleSet: the
+# FROM_BLOCK actions are never valid.
+
+N_CARDS = len(VALUES) * len(SUITS)
+N_DEALT = NUM_PLAY_PILES * (NUM_PLAY_PILES + 1) // 2
+MAX_PILE = NUM_PLAY_PILES - 1 + len(VALUES) # face-down cards + a full run
+DRAW_COUNT = 3
+WIN_REWARD = 100
+
+# CAN_STACK[higher, lower] as STACK_KEY[higher] == CARD_KEY[lower], which
+# broadcasts over whole runs much faster than indexing CAN_STACK: cards
+# with the same CAN_STACK column share a key, and the cards that can go on
+# a card always make up a single key (-1 for none)
+CARD_KEY = np.unique(CAN_STACK.T, axis=0, return_inverse=True)[1].reshape(-1).astype(np.int8)
+STACK_KEY = np.array([CARD_KEY[cards[0]] if cards else -1 for cards in STACKS_ON], dtype=np.int8)
+assert np.array_equal(STACK_KEY[:, None] == CARD_KEY[None, :], CAN_STACK)
+
+# action tables
+_kinds = []
+for move in ACTION_MOVES:
+    if move[0] == TO_BLOCK:
+        _kinds.append(0 if move[1] != -1 else 1)
+    elif move[0] == TO_PILE and len(move) == 3:
+        _kinds.append(2 if move[1] != -1 else 3)
+    elif move[0] == TO_PILE:
+        _kinds.append(4)
+    elif move[0] == DEAL_CARDS:
+        _kinds.append(5)
+    else:
+        _kinds.append(6)
+BLOCK_FROM_PILE, BLOCK_FROM_SIDE, KING_TO_EMPTY, SIDE_TO_PILE, RUN_TO_PILE, DEAL, FROM_BLOCK = range(7)
+ACTION_KIND = np.array(_kinds, dtype=np.int8)
+ACTION_SRC = np.array([move[1] for move in ACTION_MOVES], dtype=np.int8)
+ACTION_DST = np.array([move[2] for move in ACTION_MOVES], dtype=np.int8)
+ACTION_COUNT = np.array([move[3] if len(move) == 4 else 1 for move in ACTION_MOVES], dtype=np.int8)
+ACTION_REWARD = np.array([DEFAULT_RULES.reward(move) for move in ACTION_MOVES], dtype=np.float32)
+
+_first = {kind: int(np.flatnonzero(ACTION_KIND == kind)[0]) for kind in range(6)}
+_OFF_I, _OFF_J = np.nonzero(~np.eye(NUM_PLAY_PILES, dtype=bool)) # pile pairs i != j
+
+
+class BatchGame:
+
+    def __init__(self, n_games, seed=None, max_steps=None):
+        self.n_games = n_games
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+
+        self.tableau = np.zeros((n_games, NUM_PLAY_PILES, MAX_PILE), dtype=np.uint8) # bottom to top
+        self.pile_len = np.zeros((n_games, NUM_PLAY_PILES), dtype=np.int16)
+        self.down = np.zeros((n_games, NUM_PLAY_PILES), dtype=np.int16) # face-down cards per pile
+        self.foundation = np.zeros((n_games, len(SUITS)), dtype=np.int16)
+        # deck cards followed by the side pile, side_len cards at the end
+        self.deck = np.zeros((n_games, N_CARDS), dtype=np.uint8)
+        self.deck_len = np.zeros(n_games, dtype=np.int16)
+        self.side_len = np.zeros(n_games, dtype=np.int16)
+        self.steps = np.zeros(n_games, dtype=np.int64)
+
+        self.reset()
+
+    def reset(self, games=None, deals=None):
+        # deals: one row of 52 card codes per game (e.g. from deals.load_corpus),
+        # random deals otherwise
+        if games is None:
+            games = np.arange(self.n_games)
+        games = np.asarray(games)
+        if len(games) == 0:
+            return
+
+        if deals is None:
+            deals = np.argsort(self.rng.random((len(games), N_CARDS)), axis=1).astype(np.uint8)
+        self.deal(games, np.asarray(deals, dtype=np.uint8))
+
+    def deal(self, games, perm):
+        # lay out shuffled decks the way Game.__init__ does
+        self.tableau[games] = 0
+        start = 0
+        for i in range(NUM_PLAY_PILES):
+            self.tableau[games, i, :i + 1] = perm[:, start:start + i + 1]
+            self.pile_len[games, i] = i + 1
+            self.down[games, i] = i
+            start += i + 1
+        self.foundation[games] = 0
+        self.deck[games] = 0
+        self.deck[games, :N_CARDS - N_DEALT] = perm[:, N_DEALT:]
+        self.deck_len[games] = N_CARDS - N_DEALT
+        self.side_len[games] = 0
+        self.steps[games] = 0
+
+    def load_game(self, i, game):
+        game.get_valid_moves() # flips the pile tops
+        self.tableau[i] = 0
+        for p, pile in enumerate(game.playPiles):
+            codes = [card.code for card in pile.cards]
+            self.tableau[i, p, :len(codes)] = codes
+            self.pile_len[i, p] = len(codes)
+            self.down[i, p] = pile.face_down_count()
+        for s, suit in enumerate(SUITS):
+            self.foundation[i, s] = len(game.blockPiles[suit].cards)
+        codes = [card.code for card in game.deck.cards] + [card.code for card in game.deck.side_pile]
+        self.deck[i] = 0
+        self.deck[i, :len(codes)] = codes
+        self.deck_len[i] = len(codes)
+        self.side_len[i] = len(game.deck.side_pile)
+        self.steps[i] = 0
+
+    def tops(self):
+        idx = np.maximum(self.pile_len - 1, 0)[:, :, None]
+        return np.take_along_axis(self.tableau, idx, axis=2)[:, :, 0]
+
+    def side_top(self):
+        idx = np.maximum(self.deck_len - 1, 0)[:, None]
+        return np.take_along_axis(self.deck, idx, axis=1)[:, 0]
+
+    def valid_move_mask(self):
+        n = self.n_games
+        mask = np.zeros((n, N_ACTIONS), dtype=bool)
+        rows = np.arange(n)[:, None]
+
+        tops = self.tops()
+        nonempty = self.pile_len > 0
+        empty = ~nonempty
+        has_side = self.side_len > 0
+        side = self.side_top()
+
+        #1: play pile tops to the block piles
+        mask[:, _first[BLOCK_FROM_PILE]:_first[BLOCK_FROM_PILE] + NUM_PLAY_PILES] = (
+            nonempty & (CARD_RANK[tops] == self.foundation[rows, CARD_SUIT[tops]]))
+
+        #2: side card to the block piles
+        mask[:, _first[BLOCK_FROM_SIDE]] = has_side & (
+            CARD_RANK[side] == self.foundation[np.arange(n), CARD_SUIT[side]])
+
+        #3: kings to empty piles, mask[dest i, origin j]
+        movable_king = (self.pile_len > 1) & (CARD_RANK[tops] == KING_RANK)
+        kings = empty[:, :, None] & movable_king[:, None, :]
+        mask[:, _first[KING_TO_EMPTY]:_first[SIDE_TO_PILE]] = kings[:, _OFF_I, _OFF_J]
+
+        #3 + #4: side card to an empty pile (king) or onto a pile
+        side_king = has_side & (CARD_RANK[side] == KING_RANK)
+        mask[:, _first[SIDE_TO_PILE]:_first[RUN_TO_PILE]] = (
+            (empty & side_king[:, None])
+            | (nonempty & has_side[:, None] & (STACK_KEY[tops] == CARD_KEY[side][:, None])))
+
+        #5: runs of n face-up cards from pile i onto pile j, mask[i, j, n - 1]
+        sizes = np.arange(1, MAX_RUN + 1)
+        idx = self.pile_len[:, :, None] - sizes[None, None, :]
+        in_run = idx >= self.down[:, :, None]
+        run_cards = np.take_along_axis(self.tableau, np.maximum(idx, 0), axis=2)
+        run_keys = np.where(in_run, CARD_KEY[run_cards], -2)
+        top_keys = np.where(nonempty, STACK_KEY[tops], -3)
+        runs = run_keys[:, :, None, :] == top_keys[:, None, :, None]
+        mask[:, _first[RUN_TO_PILE]:_first[DEAL]] = runs[:, _OFF_I, _OFF_J].reshape(n, -1)
+
+        # deal cards to the side pile
+        mask[:, _first[DEAL]] = True
+
+        return mask
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        kind = ACTION_KIND[actions]
+        src = ACTION_SRC[actions].astype(np.intp)
+        dst = ACTION_DST[actions].astype(np.intp)
+
+        # play pile top to block
+        g = np.flatnonzero(kind == BLOCK_FROM_PILE)
+        if len(g):
+            cards = self.tableau[g, src[g], self.pile_len[g, src[g]] - 1]
+            self.foundation[g, CARD_SUIT[cards]] += 1
+            self.pile_len[g, src[g]] -= 1
+
+        # side card to block
+        g = np.flatnonzero(kind == BLOCK_FROM_SIDE)
+        if len(g):
+            cards = self.deck[g, self.deck_len[g] - 1]
+            self.foundation[g, CARD_SUIT[cards]] += 1
+            self.deck_len[g] -= 1
+            self.side_len[g] -= 1
+
+        # side card to a play pile
+        g = np.flatnonzero(kind == SIDE_TO_PILE)
+        if len(g):
+            self.tableau[g, dst[g], self.pile_len[g, dst[g]]] = self.deck[g, self.deck_len[g] - 1]
+            self.pile_len[g, dst[g]] += 1
+            self.deck_len[g] -= 1
+            self.side_len[g] -= 1
+
+        # n cards between play piles (kings to empty piles move one card)
+        g = np.flatnonzero((kind == KING_TO_EMPTY) | (kind == RUN_TO_PILE))
+        if len(g):
+            count = ACTION_COUNT[actions[g]].astype(np.int16)
+            k = np.arange(MAX_RUN)[None, :]
+            moved = k < count[:, None]
+            rows = np.broadcast_to(g[:, None], moved.shape)[moved]
+            from_idx = (self.pile_len[g, src[g]] - count)[:, None] + k
+            to_idx = self.pile_len[g, dst[g]][:, None] + k
+            cards = self.tableau[rows, np.broadcast_to(src[g][:, None], moved.shape)[moved], from_idx[moved]]
+            self.tableau[rows, np.broadcast_to(dst[g][:, None], moved.shape)[moved], to_idx[moved]] = cards
+            self.pile_len[g, src[g]] -= count
+            self.pile_len[g, dst[g]] += count
+
+        # deal: recycle the side pile to the back of the deck, then draw
+        # up to three cards, i.e. rotate deck + side pile left
+        g = np.flatnonzero((kind == DEAL) & (self.deck_len > 0))
+        if len(g):
+            size = self.deck_len[g].astype(np.intp)
+            drawn = np.minimum(DRAW_COUNT, size)
+            k = np.arange(N_CARDS)[None, :]
+            idx = np.where(k < size[:, None], (k + drawn[:, None]) % size[:, None], k)
+            self.deck[g] = np.take_along_axis(self.deck[g], idx, axis=1)
+            self.side_len[g] = drawn
+
+        # flip up face-down pile ends
+        self.down = np.minimum(self.down, np.maximum(self.pile_len - 1, 0))
+
+        # reorder the piles by size like Game.step
+        order = np.argsort(self.pile_len, axis=1, kind="stable")
+        self.tableau = np.take_along_axis(self.tableau, order[:, :, None], axis=1)
+        self.pile_len = np.take_along_axis(self.pile_len, order, axis=1)
+        self.down = np.take_along_axis(self.down, order, axis=1)
+
+        self.steps += 1
+        wins = self.foundation.sum(axis=1) == N_CARDS
+        rewards = ACTION_REWARD[actions] + WIN_REWARD * wins
+        dones = wins.copy()
+        if self.max_steps is not None:
+            dones |= self.steps >= self.max_steps
+
+        # finished games start over with a new deal
+        self.reset(np.flatnonzero(dones))
+
+        return rewards, dones, wins
+
+    def sample_actions(self, mask=None):
+        # uniformly random valid action per game (every game can deal, so
+        # each row has at least one)
+        if mask is None:
+            mask = self.valid_move_mask()
+        rows, actions = np.nonzero(mask)
+        counts = np.bincount(rows, minlength=self.n_games)
+        starts = np.cumsum(counts) - counts
+        picks = starts + (self.rng.random(self.n_games) * counts).astype(np.int64)
+        return actions[picks]
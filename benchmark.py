@@ -0,0 +1,172 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+import warnings
+
+import main
+from solitaire import Game, RULE_SETS
+
+# Throughput of the simulator hot path on fixed seeded deals. Every game
+# plays the same seeded random moves, and each Game call is timed on its own.
+# Each measurement is repeated and the fastest run kept, to damp noise from
+# the machine. Results are written as JSON and can be checked against a
+# saved baseline: any metric slower than the baseline by more than
+# --tolerance fails. The hot path is also timed under each of the other
+# RULE_SETS, shown for comparison but not checked against the baseline.
+
+METHODS = [
+    "Game.__init__", "get_valid_moves", "do_move", "undo_move", "step",
+    "current_state", "state_to_str", "already_visited",
+]
+VARIANT_METHODS = ["get_valid_moves", "do_move", "step"]
+
+
+def bench_game(n_games=50, n_steps=200, game_kwargs=None):
+    game_kwargs = game_kwargs or {}
+    totals = {name: 0 for name in METHODS}
+    calls = {name: 0 for name in METHODS}
+    clock = time.perf_counter_ns
+
+    def timed(name, f, *args):
+        start = clock()
+        result = f(*args)
+        totals[name] += clock() - start
+        calls[name] += 1
+        return result
+
+    for seed in range(n_games):
+        for _ in range(10): # construction is quick, average over a few
+            game = timed("Game.__init__", lambda: Game(seed=seed, **game_kwargs))
+        rng = random.Random(seed)
+        for _ in range(n_steps):
+            moves = timed("get_valid_moves", game.get_valid_moves)
+            if len(moves) == 0: # lost, with a limited number of redeals
+                break
+            move = moves[rng.randrange(len(moves))]
+
+            timed("do_move", game.do_move, move)
+            timed("undo_move", game.undo_move)
+            timed("step", game.step, move)
+
+            timed("current_state", game.current_state)
+            timed("state_to_str", game.state_to_str)
+            timed("already_visited", game.already_visited)
+
+    return {
+        name: {
+            "calls": calls[name],
+            "us_per_call": totals[name] / calls[name] / 1000,
+            "calls_per_sec": calls[name] / (totals[name] / 1e9),
+        }
+        for name in METHODS
+    }
+
+
+def bench_main(n_episodes=20, seed=0):
+    epsilons = [0.9, 0.9, 0.7, 0.5, 0.1]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore") # means over no won games
+        main.main(epsilons, n_episodes, 1, seed=seed)
+    elapsed = time.perf_counter() - start
+    # main.main plays episodes 1 .. n_train + n_test - 1
+    return {"episodes": n_episodes, "seconds": elapsed, "episodes_per_sec": n_episodes / elapsed}
+
+
+def best_of(runs, methods):
+    return {name: min((r[name] for r in runs), key=lambda stats: stats["us_per_call"]) for name in methods}
+
+
+def run(n_games=50, n_steps=200, n_episodes=20, game_kwargs=None, repeat=3, variants=()):
+    # variants: names in RULE_SETS to time besides the default rules
+    game_kwargs = game_kwargs or {}
+    methods = best_of([bench_game(n_games, n_steps, game_kwargs) for _ in range(repeat)], METHODS)
+    main_stats = max((bench_main(n_episodes) for _ in range(repeat)), key=lambda stats: stats["episodes_per_sec"])
+    variant_stats = {}
+    for rules in variants:
+        kwargs = dict(game_kwargs, rules=rules)
+        variant_stats[rules] = best_of([bench_game(n_games, n_steps, kwargs) for _ in range(repeat)], VARIANT_METHODS)
+    return {
+        "python": platform.python_version(),
+        "config": {"n_games": n_games, "n_steps": n_steps, "n_episodes": n_episodes,
+                   "repeat": repeat, "game_kwargs": game_kwargs},
+        "methods": methods,
+        "main": main_stats,
+        "variants": variant_stats,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    # returns the list of (metric, baseline, current) that regressed
+    regressions = []
+    for name, stats in results["methods"].items():
+        if name not in baseline["methods"]:
+            continue
+        old, new = baseline["methods"][name]["us_per_call"], stats["us_per_call"]
+        if new > old * (1 + tolerance):
+            regressions.append((name + " us/call", old, new))
+    old, new = baseline["main"]["episodes_per_sec"], results["main"]["episodes_per_sec"]
+    if new < old / (1 + tolerance):
+        regressions.append(("main episodes/s", old, new))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print("{:20s} {:>10s} {:>12s} {:>14s}".format("method", "calls", "us/call", "calls/s"))
+    for name, stats in results["methods"].items():
+        line = "{:20s} {:10d} {:12.2f} {:14.0f}".format(
+            name, stats["calls"], stats["us_per_call"], stats["calls_per_sec"])
+        if baseline is not None and name in baseline["methods"]:
+            line += "  ({:+.0%})".format(stats["us_per_call"] / baseline["methods"][name]["us_per_call"] - 1)
+        print(line)
+    print("main.main: {:.2f} episodes/s".format(results["main"]["episodes_per_sec"]))
+
+    variants = results.get("variants", {})
+    if variants:
+        print()
+        print("{:24s}".format("rules (us/call)") + "".join("{:>16s}".format(name) for name in VARIANT_METHODS))
+        rows = [("default", results["methods"])] + list(variants.items())
+        for rules, methods in rows:
+            print("{:24s}".format(rules) + "".join("{:16.2f}".format(methods[name]["us_per_call"])
+                                                   for name in VARIANT_METHODS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the solitaire simulator")
+    parser.add_argument("--games", type=int, default=50, help="seeded deals to play")
+    parser.add_argument("--steps", type=int, default=200, help="moves per deal")
+    parser.add_argument("--episodes", type=int, default=20, help="main.main episodes")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best is kept")
+    parser.add_argument("--compact-cards", action="store_true")
+    parser.add_argument("--visited", default="zobrist")
+    parser.add_argument("--move-kernel", action="store_true", help="generate moves with kernels.py")
+    parser.add_argument("--rules", nargs="*", default=[name for name in RULE_SETS if name != "default"],
+                        choices=list(RULE_SETS), help="rule variants to time as well (default: all)")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline")
+    args = parser.parse_args()
+
+    game_kwargs = {"compact_cards": args.compact_cards, "visited": args.visited, "move_kernel": args.move_kernel}
+    results = run(args.games, args.steps, args.episodes, game_kwargs, args.repeat, args.rules)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new in regressions:
+            print("REGRESSION {}: {:.2f} -> {:.2f}".format(name, old, new))
+        sys.exit(1 if regressions else 0)
@@ -1,11 +1,21 @@
+import collections
 import random
 
+import zobrist
+
 class Card:
+
+    # rank/color/code are small ints precomputed by Deck.populate so rule
+    # checks can be done with arithmetic instead of string lookups
+    __slots__ = ("suit", "value", "flipped", "rank", "color", "code")
     
-    def __init__(self, suit, value):
+    def __init__(self, suit, value, rank=0, color=0, code=0):
         self.suit = suit
         self.value = value
         self.flipped = False
+        self.rank = rank
+        self.color = color
+        self.code = code
         
     def flip(self):
         self.flipped = not self.flipped
@@ -14,38 +24,119 @@ class Card:
         return "{0} {1}".format(self.value,self.suit)
     
 class Pile:
+
+    # cards are listed bottom to top: cards[-1] is the top card, so adding
+    # and taking cards only touches the end of the list. down is the number
+    # of face-down cards at the bottom, kept up to date by the methods below
+    # (cards placed from the side pile can be face-down for a move, until
+    # Game.get_valid_moves flips them: they are not counted in down)
     
     def __init__(self):
         self.cards = []
+        self.down = 0
         
     def addCard(self, Card):
-        self.cards.insert(0,Card)
+        if self.down == len(self.cards) and not Card.flipped:
+            self.down += 1
+        self.cards.append(Card)
+
+    def addCards(self, cards):
+        if self.down == len(self.cards):
+            for card in cards:
+                if card.flipped: break
+                self.down += 1
+        self.cards.extend(cards)
+
+    def takeCard(self):
+        card = self.cards.pop()
+        self.down = min(self.down, len(self.cards))
+        return card
+
+    def takeCards(self, n):
+        # the top n cards, bottom first
+        cards = self.cards[-n:]
+        del self.cards[-n:]
+        self.down = min(self.down, len(self.cards))
+        return cards
         
     def flipFirstCard(self):
         if len(self.cards)>0:
-            self.cards[0].flip()
+            card = self.cards[-1]
+            card.flip()
+            if card.flipped and self.down == len(self.cards):
+                self.down -= 1
+            elif not card.flipped and self.down == len(self.cards) - 1:
+                self.down += 1
+
+    def face_down_count(self):
+        return self.down
+
+    def face_up_count(self):
+        return len(self.cards) - self.down
+
+    def face_up_run(self):
+        return PileRun(self.cards, self.down)
             
     def getFlippedCards(self):
         return [card for card in self.cards if card.flipped]
     
     def __str__(self):
-        # if len(self.cards) > 0:
-        #     print("Bottom card {}".format(str(self.cards[0])))
-
-        returnedCards = [str(card) for card in reversed(self.getFlippedCards())]
-        flippedDownCount = len(self.cards) - len(self.getFlippedCards())
+        returnedCards = [str(card) for card in self.cards if card.flipped]
+        flippedDownCount = len(self.cards) - len(returnedCards)
         if flippedDownCount>0:
             returnedCards.insert(0,"{0} cards flipped down".format(flippedDownCount))
         return ", ".join(returnedCards)
 
+
+class PileRun:
+
+    # the face-up cards of a pile, cards[start:], without copying them.
+    # Indexes count like a list: run[-1] is the top card
+
+    __slots__ = ("cards", "start")
+
+    def __init__(self, cards, start):
+        self.cards = cards
+        self.start = start
+
+    def __len__(self):
+        return len(self.cards) - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.cards[self.start:][i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("run index out of range")
+        return self.cards[self.start + i]
+
+    def __iter__(self):
+        for i in range(self.start, len(self.cards)):
+            yield self.cards[i]
+
 class Deck: 
     
-    def __init__(self, values, suits):
-        self.cards = []
+    def __init__(self, values, suits, seed=None, order=None, draw_count=3):
+        # seed: shuffle with a private random.Random(seed) instead of the
+        # global random module
+        # order: card codes to lay the deck out in, instead of shuffling
+        # draw_count: cards drawCardsToSide deals to the side pile
+        # cards is a deque, cards[0] being the next card to draw, so cycling
+        # the stock is O(1) per card
+        self.rng = random.Random(seed) if seed is not None else random
+        self.draw_count = draw_count
+        self.cards = collections.deque()
         self.cache = []
         self.side_pile = []
+        # incrementally maintained Zobrist hashes of cards and side_pile
+        self.cards_hash = 0
+        self.side_hash = 0
         self.populate(values,suits)
-        self.shuffle()
+        if order is None:
+            self.shuffle()
+        else:
+            self.arrange(order)
         
     def __str__(self):
         deck = ", ".join([str(card) for card in self.cards])
@@ -53,13 +144,57 @@ class Deck:
         return deck + "/" + side
 
     def populate(self, values, suits):
-        for suit in suits:
-            for value in values:
-                thisCard = Card(suit,value)
+        # suits is either a list of suits or a dict of suit -> color
+        colors = suits if isinstance(suits, dict) else {suit: suit for suit in suits}
+        color_ids = list(dict.fromkeys(colors.values()))
+        for s, suit in enumerate(suits):
+            for r, value in enumerate(values):
+                thisCard = Card(suit, value, r, color_ids.index(colors[suit]), s*len(values) + r)
                 self.cards.append(thisCard)  
+        self.rehash()
     
     def shuffle(self):
-        random.shuffle(self.cards)
+        cards = list(self.cards)
+        self.rng.shuffle(cards)
+        self.cards = collections.deque(cards)
+        self.rehash()
+
+    def arrange(self, order):
+        cards = {card.code: card for card in self.cards}
+        self.cards = collections.deque(cards[int(code)] for code in order)
+        self.rehash()
+
+    def codes(self):
+        return [card.code for card in self.cards]
+
+    def rehash(self):
+        self.cards_hash = zobrist.deck_hash(self.cards)
+        self.side_hash = zobrist.side_hash(self.side_pile)
+
+    def zobrist(self):
+        return self.cards_hash ^ self.side_hash
+
+    def pass_hash(self):
+        # hash of the state of the stock not in cards or side_pile, see LimitedDeck
+        return 0
+
+    def appendCard(self, card):
+        self.cards_hash = (self.cards_hash + zobrist.DECK[card.code] * zobrist.BASE_POW[len(self.cards)]) & zobrist.MASK
+        self.cards.append(card)
+
+    def insertFirstCard(self, card):
+        self.cards_hash = (self.cards_hash * zobrist.BASE + zobrist.DECK[card.code]) & zobrist.MASK
+        self.cards.appendleft(card)
+
+    def popFirstCard(self):
+        card = self.cards.popleft()
+        self.cards_hash = ((self.cards_hash - zobrist.DECK[card.code]) * zobrist.BASE_INV) & zobrist.MASK
+        return card
+
+    def popLastCard(self):
+        card = self.cards.pop()
+        self.cards_hash = (self.cards_hash - zobrist.DECK[card.code] * zobrist.BASE_POW[len(self.cards)]) & zobrist.MASK
+        return card
     
     def getFirstCard(self):
         if len(self.cards)>0:
@@ -69,7 +204,7 @@ class Deck:
     
     def takeFirstCard(self, flip=True):
         if len(self.cards)>0:
-            nextCard = self.cards.pop(0)
+            nextCard = self.popFirstCard()
             if flip and len(self.cards)>0:
                 self.cards[0].flip()
             return nextCard
@@ -84,16 +219,20 @@ class Deck:
     
     def takeFirstSideCard(self, flip=True):
         if len(self.side_pile)>0:
-            nextCard = self.side_pile[-1]
-            self.side_pile = self.side_pile[:-1]
+            nextCard = self.side_pile.pop()
+            self.side_hash ^= zobrist.SIDE[nextCard.code][len(self.side_pile)]
             return nextCard
         else:
             return None
+
+    def putBackSideCard(self, card):
+        self.side_hash ^= zobrist.SIDE[card.code][len(self.side_pile)]
+        self.side_pile.append(card)
         
     def drawCard(self):
         if len(self.cards)>0:
             self.cards[0].flip()
-            self.cards.append(self.cards.pop(0))
+            self.appendCard(self.popFirstCard())
             self.cards[0].flip()
 
     def print_all(self):  
@@ -108,22 +247,100 @@ class Deck:
         print("")
 
 
-    def drawCardsToSide(self):
+    def can_deal(self):
+        return True
+
+    def drawCardsToSide(self, n=None):
+        # n: cards to draw, draw_count by default
+        recycled = len(self.side_pile)
         if len(self.side_pile) > 0:
             for i in range(len(self.side_pile)):
                 self.side_pile[i].flip()
-                self.cards.append(self.side_pile[i])
+                self.appendCard(self.side_pile[i])
             self.side_pile = []
+            self.side_hash = 0
 
         if len(self.cards)>0:
-            for _ in range(3):
+            for _ in range(self.draw_count if n is None else n):
                 if len(self.cards) > 0:
                     self.cards[0].flip()
-                    self.side_pile.append(self.cards.pop(0))
+                    self.putBackSideCard(self.popFirstCard())
+
+        # returned so the move can be reverted with undoDrawCardsToSide
+        return recycled, len(self.side_pile)
+
+    def undoDrawCardsToSide(self, recycled, drawn):
+        for _ in range(drawn):
+            card = self.side_pile.pop()
+            card.flip()
+            self.insertFirstCard(card)
+        for _ in range(recycled):
+            card = self.popLastCard()
+            card.flip()
+            self.side_pile.append(card)
+        self.side_pile.reverse()
+        self.side_hash = zobrist.side_hash(self.side_pile)
+
+    def copy(self, deep=True):
+        new_deck = Deck([1], ["A"], draw_count=self.draw_count)
+        new_deck.cards = collections.deque(self.cards)
+        new_deck.cache = self.cache[:]
+        new_deck.side_pile = self.side_pile[:]
+        new_deck.cards_hash = self.cards_hash
+        new_deck.side_hash = self.side_hash
+        return new_deck
+
+
+class LimitedDeck(Deck):
+
+    # a stock that can only be gone through 1 + max_redeals times. The
+    # first pass_left cards are the ones not drawn yet in this pass (the
+    # side pile goes back to the end of cards at every deal); a deal with
+    # none left turns the whole side pile over and starts a new pass
+
+    def __init__(self, values, suits, seed=None, order=None, draw_count=3, max_redeals=0):
+        super().__init__(values, suits, seed, order, draw_count)
+        self.max_redeals = max_redeals
+        self.redeals = 0
+        self.pass_left = len(self.cards) # cards dealt to the piles come off the front
+        self.pass_history = [] # (redeals, pass_left) before each draw, for undo
+
+    def remaining(self):
+        return min(self.pass_left, len(self.cards))
+
+    def zobrist(self):
+        return self.cards_hash ^ self.side_hash ^ self.pass_hash()
+
+    def pass_hash(self):
+        return zobrist.mix((self.redeals << 8) | self.remaining())
+
+    def can_deal(self):
+        if self.remaining() > 0:
+            return True
+        return self.redeals < self.max_redeals and len(self.side_pile) + len(self.cards) > 0
+
+    def drawCardsToSide(self, n=None):
+        self.pass_history.append((self.redeals, self.pass_left))
+        self.pass_left = self.remaining()
+        if self.pass_left == 0:
+            self.redeals += 1
+            self.pass_left = len(self.cards) + len(self.side_pile)
+        n = min(self.draw_count, self.pass_left)
+        self.pass_left -= n
+        return super().drawCardsToSide(n)
+
+    def undoDrawCardsToSide(self, recycled, drawn):
+        super().undoDrawCardsToSide(recycled, drawn)
+        self.redeals, self.pass_left = self.pass_history.pop()
 
     def copy(self, deep=True):
-        new_deck = Deck([1], ["A"])
-        new_deck.cards = self.cards[:]
+        new_deck = LimitedDeck([1], ["A"], draw_count=self.draw_count, max_redeals=self.max_redeals)
+        new_deck.cards = collections.deque(self.cards)
         new_deck.cache = self.cache[:]
         new_deck.side_pile = self.side_pile[:]
+        new_deck.cards_hash = self.cards_hash
+        new_deck.side_hash = self.side_hash
+        new_deck.redeals = self.redeals
+        new_deck.pass_left = self.pass_left
+        new_deck.pass_history = self.pass_history[:]
         return new_deck
@@ -0,0 +1,118 @@
+import collections
+import csv
+import os
+import random
+
+import numpy as np
+
+from qtable import QTable
+
+# Training checkpoints and metrics.
+#
+# A checkpoint is an .npz file holding the known Q-table entries as flat
+# arrays (QTable.to_arrays), the number of the last finished episode, the
+# win counters and both random generator states. Without a replay buffer
+# a resumed run plays the same episodes as one that was never interrupted;
+# the buffer is not saved, so with replay_capacity it starts out empty
+# again and the runs part ways.
+#
+# The checkpoint is written to a temporary file and moved over the old
+# one with os.replace, so a crash leaves either the old or the new
+# checkpoint, never half of one.
+#
+# The metrics log is a CSV with one row per episode, appended and flushed
+# as episodes finish, with the win rate and mean moves over the last
+# `window` episodes.
+
+METRICS_FIELDS = ["episode", "win", "moves", "distance", "epsilon", "win_rate", "mean_moves"]
+
+
+def save_checkpoint(path, q_table, episode, n_win_train=0, n_win_test=0):
+    py_version, py_state, py_gauss = random.getstate()
+    np_name, np_keys, np_pos, np_has_gauss, np_gauss = np.random.get_state()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            episode=np.int64(episode),
+            n_win=np.array([n_win_train, n_win_test], dtype=np.int64),
+            py_random=np.array(py_state, dtype=np.uint32),
+            py_gauss=np.array(np.nan if py_gauss is None else py_gauss),
+            np_random=np_keys,
+            np_random_pos=np.array([np_pos, np_has_gauss], dtype=np.int64),
+            np_random_gauss=np.array(np_gauss),
+            **q_table.to_arrays())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, restore_random=True):
+    # returns (q_table, episode, n_win_train, n_win_test)
+    with np.load(path) as data:
+        q_table = QTable.from_arrays(data)
+        if restore_random:
+            py_gauss = float(data["py_gauss"])
+            random.setstate((3, tuple(int(x) for x in data["py_random"]),
+                             None if np.isnan(py_gauss) else py_gauss))
+            pos, has_gauss = data["np_random_pos"]
+            np.random.set_state(("MT19937", data["np_random"], int(pos), int(has_gauss),
+                                 float(data["np_random_gauss"])))
+        n_win_train, n_win_test = data["n_win"]
+        return q_table, int(data["episode"]), int(n_win_train), int(n_win_test)
+
+
+class MetricsLog:
+
+    def __init__(self, path, window=100, resume_from=None):
+        # resume_from: last episode of the checkpoint being resumed, later
+        # rows are dropped since those episodes will be played again
+        self.path = path
+        self.wins = collections.deque(maxlen=window)
+        self.moves = collections.deque(maxlen=window)
+
+        rows = []
+        if resume_from is not None and os.path.exists(path):
+            rows = [row for row in read_rows(path) if int(row["episode"]) <= resume_from]
+        for row in rows:
+            self.wins.append(int(row["win"]))
+            self.moves.append(int(row["moves"]))
+
+        tmp = path + ".tmp"
+        with open(tmp, "w", newline="") as f:
+            writer = csv.DictWriter(f, METRICS_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp, path)
+
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+
+    def log(self, episode, win, moves, distance, epsilon):
+        self.wins.append(int(win))
+        self.moves.append(moves)
+        self.writer.writerow([episode, int(win), moves, distance, epsilon,
+                              "{:.4f}".format(self.win_rate()), "{:.2f}".format(self.mean_moves())])
+        self.file.flush()
+
+    def win_rate(self):
+        return sum(self.wins) / len(self.wins) if self.wins else 0.0
+
+    def mean_moves(self):
+        return sum(self.moves) / len(self.moves) if self.moves else 0.0
+
+    def close(self):
+        self.file.close()
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def read_metrics(path):
+    # (moves, wins, distances) arrays of a metrics log, as report() takes them
+    rows = read_rows(path)
+    return (np.array([int(row["moves"]) for row in rows]),
+            np.array([row["win"] == "1" for row in rows]),
+            np.array([int(row["distance"]) for row in rows]))
@@ -0,0 +1,54 @@
+import argparse
+import os
+
+import numpy as np
+
+from card_elements import Deck
+from solitaire import Game, VALUES, SUITS
+
+# A deal corpus is a flat binary file of uint8 card codes, 52 bytes per deal
+# giving the deck order Game deals from (Game(deal=...)). It is read back
+# with numpy.memmap, so streaming deals costs no shuffling and no parsing.
+
+N_CARDS = len(VALUES) * len(SUITS)
+
+
+def deal_from_seed(seed):
+    # the deal Game(seed=seed) plays
+    return np.array(Deck(VALUES, SUITS, seed=seed).codes(), dtype=np.uint8)
+
+
+def generate_corpus(path, n_deals, seed=0, chunk_size=100000):
+    deals = np.memmap(path, dtype=np.uint8, mode="w+", shape=(n_deals, N_CARDS))
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_deals, chunk_size):
+        n = min(chunk_size, n_deals - start)
+        deals[start:start + n] = np.argsort(rng.random((n, N_CARDS)), axis=1)
+    deals.flush()
+    return deals
+
+
+def load_corpus(path):
+    n_deals = os.path.getsize(path) // N_CARDS
+    return np.memmap(path, dtype=np.uint8, mode="r", shape=(n_deals, N_CARDS))
+
+
+def game_from_corpus(deals, i, **kwargs):
+    return Game(deal=deals[i], **kwargs)
+
+
+def split_corpus(deals, held_out=0.1):
+    # the last held_out fraction of a corpus is kept for evaluation
+    n_eval = int(len(deals) * held_out)
+    return deals[:len(deals) - n_eval], deals[len(deals) - n_eval:]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate a corpus of solitaire deals")
+    parser.add_argument("path")
+    parser.add_argument("--n", type=int, default=1000000, help="number of deals")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_corpus(args.path, args.n, args.seed)
+    print("Wrote {} deals ({} bytes) to {}".format(args.n, args.n * N_CARDS, args.path))
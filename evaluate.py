@@ -0,0 +1,163 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from solitaire import Game
+from main import play_episode
+from qtable import QTable, MAGIC, load_qtable, load_pickle
+from deals import load_corpus
+from solver import solve, SOLVABLE, foundation_count, parse_range
+
+# Scores a policy over many deals. Deals come from a seed range
+# (Game(seed=...)) or a deal corpus (deals.py); each is played once by the
+# chosen policy in a process pool, and one CSV row per deal is appended to
+# the output as soon as it finishes. Rows come back in completion order.
+# Running again with the same output skips the deals already in the file,
+# so an interrupted run can be resumed.
+#
+# Policies:
+#   greedy  - Game.takeTurn, drawing one card when it finds no move
+#   random  - play_episode with epsilon 1
+#   qtable  - play_episode with epsilon 0 on a trained Q-table
+#   solver  - solver.solve, within --max-nodes / --max-seconds
+
+POLICIES = ["greedy", "random", "qtable", "solver"]
+FIELDS = ["deal", "win", "moves", "foundation", "seconds"]
+
+ALPHA = 0.2
+GAMMA = 0.9
+
+# per worker, set by init_worker
+worker = {}
+
+
+def load_q_table(path):
+    # a table saved with QTable.save, opened memory-mapped, or a training
+    # pickle (see qtable.load_pickle)
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return load_qtable(path)
+    return load_pickle(path)
+
+
+def play_greedy(game, max_moves=1000):
+    moves = 0
+    draws = 0 # draws since the last move, a full pass means we're stuck
+    while moves < max_moves and draws <= len(game.deck.cards):
+        if game.takeTurn():
+            moves += 1
+            draws = 0
+        else:
+            game.deck.drawCard()
+            draws += 1
+    on_block = foundation_count(game)
+    return on_block == 52, moves, on_block
+
+
+def play_deal(game_kwargs, seed, policy, options):
+    if policy == "greedy":
+        return play_greedy(Game(**game_kwargs), options["max_moves"])
+
+    if policy == "solver":
+        result = solve(Game(**game_kwargs), options["max_nodes"], options["max_seconds"])
+        moves = len(result.solution) if result.solution is not None else 0
+        return result.status == SOLVABLE, moves, result.foundation
+
+    # play_episode draws its moves from the global generators
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    epsilon = 1 if policy == "random" else 0
+    moves, win, distance = play_episode(worker["q_table"], epsilon, ALPHA, GAMMA, learn=False, **game_kwargs)
+    return win, moves, 52 - distance
+
+
+def init_worker(deals_path, q_table_path):
+    worker["deals"] = load_corpus(deals_path) if deals_path is not None else None
+    worker["q_table"] = load_q_table(q_table_path) if q_table_path is not None else QTable()
+
+
+def run_deal(args):
+    deal_id, policy, options = args
+    if worker["deals"] is not None:
+        game_kwargs = {"deal": worker["deals"][deal_id]}
+    else:
+        game_kwargs = {"seed": deal_id}
+    start = time.perf_counter()
+    win, moves, foundation = play_deal(game_kwargs, deal_id, policy, options)
+    return deal_id, int(win), moves, foundation, "{:.4f}".format(time.perf_counter() - start)
+
+
+def done_deals(path):
+    # deal ids already in a results file
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return set()
+    with open(path, newline="") as f:
+        return {int(row["deal"]) for row in csv.DictReader(f)}
+
+
+def evaluate(deal_ids, policy, output, n_workers=1, deals_path=None, q_table_path=None,
+             max_moves=1000, max_nodes=100000, max_seconds=None, verbose=True):
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy: {}".format(policy))
+    if policy == "qtable" and q_table_path is None:
+        raise ValueError("The qtable policy needs a Q-table")
+
+    done = done_deals(output)
+    todo = [deal_id for deal_id in deal_ids if deal_id not in done]
+    options = {"max_moves": max_moves, "max_nodes": max_nodes, "max_seconds": max_seconds}
+    jobs = [(deal_id, policy, options) for deal_id in todo]
+    if verbose and done:
+        print("Resuming: {} deals done, {} to go".format(len(done), len(todo)))
+
+    new_file = len(done) == 0
+    wins, n = 0, 0
+    start = time.time()
+    with open(output, "w" if new_file else "a", newline="") as f, \
+            multiprocessing.Pool(n_workers, init_worker, (deals_path, q_table_path)) as pool:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(FIELDS)
+        for row in pool.imap_unordered(run_deal, jobs, chunksize=max(1, min(64, len(jobs) // (8 * n_workers)))):
+            writer.writerow(row)
+            f.flush()
+            wins += row[1]
+            n += 1
+            if verbose and n % 1000 == 0:
+                print("{} deals, {} wins, {:.1f} deals/s".format(n, wins, n / (time.time() - start)))
+
+    if verbose:
+        print("Played {} deals with {}: {} wins".format(n, policy, wins))
+    return n, wins
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a policy over many deals")
+    parser.add_argument("policy", choices=POLICIES)
+    parser.add_argument("output", help="results CSV, appended to when it already exists")
+    parser.add_argument("--seeds", default="0-999", help="seed range, e.g. 0-999 (Game(seed=...))")
+    parser.add_argument("--deals", default=None, help="deal corpus (deals.py), overrides --seeds")
+    parser.add_argument("--first", type=int, default=0, help="first corpus deal")
+    parser.add_argument("--n", type=int, default=None, help="number of corpus deals (default: all)")
+    parser.add_argument("--q-table", default=None, help="saved Q-table (qtable.py) or pickle from main.main / train_parallel")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--max-moves", type=int, default=1000, help="greedy: moves per deal")
+    parser.add_argument("--max-nodes", type=int, default=100000, help="solver: nodes per deal")
+    parser.add_argument("--max-seconds", type=float, default=None, help="solver: seconds per deal")
+    args = parser.parse_args()
+
+    if args.deals is not None:
+        n_deals = len(load_corpus(args.deals))
+        last = n_deals if args.n is None else min(n_deals, args.first + args.n)
+        deal_ids = range(args.first, last)
+    else:
+        deal_ids = parse_range(args.seeds)
+
+    start = time.time()
+    evaluate(deal_ids, args.policy, args.output, args.workers, args.deals, args.q_table,
+             args.max_moves, args.max_nodes, args.max_seconds)
+    print("Time elapsed: {} minutes".format((time.time() - start)/60))
@@ -0,0 +1,101 @@
+import numpy as np
+
+from solitaire import (VALUES, SUITS, NUM_PLAY_PILES, KING_RANK, TO_BLOCK, TO_PILE, DEAL_CARDS, ACTION_IDS,
+                       N_ACTIONS, CARD_RANK, CARD_SUIT, CAN_STACK, STACKS_ON)
+
+# Move generation on a packed state, for Game(move_kernel=True): the rule
+# checks of Game.get_valid_moves become lookups in tables indexed by card
+# code (suit * 13 + rank) instead of Card method calls. A packed state is
+#
+#   tops     top card code of each play pile, -1 if empty
+#   lengths  number of cards in each play pile
+#   runs     face-up card codes of each play pile, bottom to top
+#   heights  cards on each block pile, in SUITS order
+#   side     top side pile card code, -1 if none
+#
+# legal_moves returns the same list as sections 1-5 of get_valid_moves, in
+# the same order; legal_mask the N_ACTIONS mask of it plus the deal.
+
+# NEXT_FOUNDATION[suit, height]: the card a block pile of that height
+# takes, -1 once it's full
+NEXT_FOUNDATION = np.full((len(SUITS), len(VALUES) + 1), -1, dtype=np.int8)
+for _s in range(len(SUITS)):
+    NEXT_FOUNDATION[_s, :len(VALUES)] = _s * len(VALUES) + np.arange(len(VALUES))
+
+# plain list views of the tables, much faster than numpy for single lookups
+_can_stack = CAN_STACK.tolist()
+_next_foundation = NEXT_FOUNDATION.tolist()
+_suit = CARD_SUIT.tolist()
+_king = (CARD_RANK == KING_RANK).tolist()
+_piles = range(NUM_PLAY_PILES)
+DEAL_ID = ACTION_IDS[(DEAL_CARDS, -1, -1)]
+
+
+def pack_state(piles, blocks, side_card):
+    # packed state of Game.playPiles, the block piles in SUITS order and
+    # the top side pile card
+    tops = [pile.cards[-1].code if len(pile.cards) > 0 else -1 for pile in piles]
+    lengths = [len(pile.cards) for pile in piles]
+    runs = [[card.code for card in pile.cards[pile.down:]] for pile in piles]
+    heights = [len(block.cards) for block in blocks]
+    side = side_card.code if side_card is not None else -1
+    return tops, lengths, runs, heights, side
+
+
+def legal_moves(tops, lengths, runs, heights, side):
+    moves = []
+
+    #1: play pile tops to the block piles
+    for i in _piles:
+        top = tops[i]
+        if top >= 0 and _next_foundation[_suit[top]][heights[_suit[top]]] == top:
+            moves.append((TO_BLOCK, i, -1))
+
+    #2: side card to the block piles
+    if side >= 0 and _next_foundation[_suit[side]][heights[_suit[side]]] == side:
+        moves.append((TO_BLOCK, -1, -1))
+
+    #3: kings to empty piles
+    for i in _piles:
+        if lengths[i] == 0:
+            for j in _piles:
+                if lengths[j] > 1 and _king[tops[j]]:
+                    moves.append((TO_PILE, j, i))
+            if side >= 0 and _king[side]:
+                moves.append((TO_PILE, -1, i))
+
+    #4: side card onto a play pile
+    if side >= 0:
+        for i in _piles:
+            if tops[i] >= 0 and _can_stack[tops[i]][side]:
+                moves.append((TO_PILE, -1, i))
+
+    #5: runs between play piles. Only two cards can go on a given top, so
+    # look them up among the face-up cards rather than trying every run size
+    where = {}
+    for i in _piles:
+        run = runs[i]
+        for n in range(1, len(run) + 1):
+            where[run[-n]] = (i, n)
+    found = []
+    for j in _piles:
+        run = runs[j]
+        if len(run) == 0: continue
+        for card in STACKS_ON[run[-1]]:
+            hit = where.get(card)
+            if hit is not None and hit[0] != j:
+                found.append((hit[0], j, hit[1]))
+    found.sort()
+    for i, j, n in found:
+        moves.append((TO_PILE, i, j, n))
+
+    return moves
+
+
+def legal_mask(tops, lengths, runs, heights, side, can_deal=True):
+    mask = np.zeros(N_ACTIONS, dtype=bool)
+    ids = [ACTION_IDS[move] for move in legal_moves(tops, lengths, runs, heights, side)]
+    if can_deal:
+        ids.append(DEAL_ID)
+    mask[ids] = True
+    return mask
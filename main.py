@@ -1,11 +1,17 @@
 import pprint
 from tqdm import tqdm
 
-from solitaire import Game
+from solitaire import Game, TerminationPolicy
+from qtable import QTable
+from checkpoint import save_checkpoint, load_checkpoint, MetricsLog, read_metrics
+from replay import ReplayBuffer, replay_updates
+from profiling import Profiler
 
 import random
 import numpy as np
 
+import cProfile
+import os
 import pickle
 import time
 
@@ -13,19 +19,182 @@ import time
 N_GAMES_TO_PLAY = 1
 
 def get_q_value(q_table, state, action):
-    if state not in q_table:
-        q_table[state] = {}
+    return q_table.get(state, action)
 
-    if action not in q_table[state]:
-        q_table[state][action] = np.random.randint(-3, 3)
+def update_q_value(q_table, state, action, reward, next_state, alpha, gamma):
+    old_value = get_q_value(q_table, state, action)
+    next_max = q_table.max(next_state)
 
-    return q_table[state][action]
+    # print(old_value, reward, next_max)
+    new_value = (1 - alpha) * old_value + alpha * (reward + gamma * next_max)
+    q_table.set(state, action, new_value)
+
+def get_epsilon(i, epsilons, n_train):
+    if i <= n_train * 1/4:
+        epsilon = epsilons[0]
+    elif i > n_train * 1/4:
+        epsilon = epsilons[1]
+    elif i > n_train * 2/4:
+        epsilon = epsilons[2]
+    elif i > n_train * 3/4:
+        epsilon = epsilons[3]
+    elif i > n_train:
+        epsilon = epsilons[4]
+    return epsilon
+
+def choose_action(q_table, state, action_ids, mask, epsilon):
+    # action_ids / mask: Game.valid_action_ids() / Game.action_mask()
+    if (random.uniform(0, 1) < epsilon) or (state not in q_table):
+        return int(action_ids[np.random.randint(len(action_ids))]) # Explore action space
+
+    best_action = q_table.best_masked(state, mask)
+    if best_action == -1: # no known action
+        return int(action_ids[np.random.randint(len(action_ids))])
+
+    return best_action # Exploit learned values
+
+def play_episode(q_table, epsilon, alpha, gamma, learn=True, transitions=None, seed=None, deal=None,
+                 profiler=None, termination=None):
+    # learn: update q_table after every move
+    # transitions: if given, (state, action, reward, next_state) tuples are appended to it
+    # seed/deal: which game to play, see Game
+    # profiler: profiling.Profiler timing the phases of the episode
+    # termination: solitaire.TerminationPolicy ending stuck games early
+    thisGame = Game(seed=seed, deal=deal, profiler=profiler, termination=termination)
+    choose = choose_action
+    update = update_q_value
+    if profiler is not None:
+        choose = profiler.wrap("choose_action", choose_action)
+        update = profiler.wrap("update_q_value", update_q_value)
+
+    epochs, penalties, reward, = 0, 0, 0
+    game_over = False
+    win = False
+    visited_count = 0
+    moves_made = 0
+    
+    while (not game_over) and (visited_count < 100):
+        state = thisGame.encode_state()
+
+        assert thisGame.check_state(), thisGame.state_to_str()
+
+        action_id = choose(q_table, state, thisGame.valid_action_ids(), thisGame.action_mask(), epsilon)
+
+        next_state, reward, move_made, game_over, win, visited = thisGame.step_id(action_id) 
+        
+        if not move_made: continue
+        if visited:
+            visited_count += 1
+            thisGame.undo_move()
+            continue
+
+        moves_made += 1
+        
+        if learn:
+            update(q_table, state, action_id, reward, next_state, alpha, gamma)
+        if transitions is not None:
+            transitions.append((state, action_id, reward, next_state))
+
+        if reward in [-10, -100]:
+            penalties += 1
+
+        state = next_state
+    
+        epochs += 1
+
+    how_far_from_win = 52 - sum([len(p.cards) for k, p in thisGame.blockPiles.items()])
+    return moves_made, win, how_far_from_win
+
+def report(all_total_moves, all_win_loss, how_far_from_win, n_win_train, n_win_test):
+    all_win_loss = np.array(all_win_loss)
+    all_total_moves = np.array(all_total_moves)
+    how_far_from_win = np.array(how_far_from_win)
+
+    print("Training finished.\n")
+    print("Won {} games in train and {} in test".format(n_win_train, n_win_test))
+    print("Mean number of moves for winning games: {}".format(
+        np.mean(all_total_moves[all_win_loss == True])
+        ))
+    print("Mean number of moves for losing games: {}".format(
+        np.mean(all_total_moves[all_win_loss == False])
+        ))
+    print("Mean distance from win: {}".format(
+        np.mean(how_far_from_win[all_win_loss == False])
+        ))
+
+    return all_total_moves, all_win_loss, how_far_from_win
 
 #### TODOs
 #### Decompose until a play_game method, that way we can evaluate the perf after training
 #### Change reward function
 
-def main(epsilons, n_train, n_test, filename=None, save=False):
+def main(epsilons, n_train, n_test, filename=None, save=False, n_workers=1, seed=None, deals_path=None,
+         checkpoint=None, checkpoint_every=1000, metrics=None, window=100, resume=False,
+         replay_capacity=None, batch_size=64, replay_ratio=1.0, prioritized=False,
+         profile=False, profile_output=None, termination=False):
+    # deals_path: deal corpus (see deals.py), episode i plays deal i - 1
+    # checkpoint: file to save the learner to every checkpoint_every episodes
+    # metrics: per-episode CSV log, with rolling aggregates over window
+    # episodes; the per-episode lists are not kept in memory when it's set
+    # resume: continue from checkpoint if it exists (see checkpoint.py);
+    # needs metrics, which hold the per-episode results of the earlier run
+    # replay_capacity: learn from minibatches of a replay buffer of that many
+    # transitions instead of after every move, replaying replay_ratio times
+    # as many transitions as each episode played (see replay.py)
+    # profile: print per-phase call counts and times at the end (profiling.py)
+    # profile_output: also write a cProfile pstats file there
+    # termination: end stuck episodes early (a TerminationPolicy, or True
+    # for the default one), False to play them out; how many ended by
+    # each rule is printed at the end
+    if n_workers > 1:
+        # self-play in a process pool, see parallel_train.py, which has none
+        # of the options below
+        given = {
+            "checkpoint": checkpoint is not None,
+            "metrics": metrics is not None,
+            "resume": resume,
+            "replay_capacity": replay_capacity is not None,
+            "profile": profile,
+            "profile_output": profile_output is not None,
+            "termination": termination not in (False, None),
+        }
+        unsupported = [name for name, used in given.items() if used]
+        if unsupported:
+            raise ValueError("Not supported with n_workers > 1: {}".format(", ".join(unsupported)))
+        from parallel_train import train_parallel
+        return train_parallel(epsilons, n_train, n_test, n_workers=n_workers,
+                              seed=seed, filename=filename, save=save, deals_path=deals_path)
+
+    if resume and metrics is None:
+        # the checkpoint only has the win counters, report() would mix them
+        # with per-episode lists of the resumed episodes alone
+        raise ValueError("resume needs a metrics log")
+
+    cprofile = None
+    if profile_output is not None:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    profiler = Profiler() if profile else None
+    episode, learn, checkpoint_to = play_episode, replay_updates, save_checkpoint
+    if profiler is not None:
+        episode = profiler.wrap("play_episode", play_episode)
+        learn = profiler.wrap("replay_updates", replay_updates)
+        checkpoint_to = profiler.wrap("save_checkpoint", save_checkpoint)
+
+    if termination is True:
+        termination = TerminationPolicy()
+    elif termination is False:
+        termination = None
+
+    deals = None
+    if deals_path is not None:
+        from deals import load_corpus
+        deals = load_corpus(deals_path)
+
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
     win = 0
 
     # Hyperparameters
@@ -34,7 +203,7 @@ def main(epsilons, n_train, n_test, filename=None, save=False):
 
     stages = []
 
-    q_table = {} # dict of states to dict of actions to value
+    q_table = QTable() # states x action ids
 
     # For plotting metrics
     all_total_moves = []
@@ -43,83 +212,52 @@ def main(epsilons, n_train, n_test, filename=None, save=False):
     n_win_train = 0
     n_win_test = 0
 
-    for i in range(1, n_train + n_test):
-        if i <= n_train * 1/4:
-            epsilon = epsilons[0]
-        elif i > n_train * 1/4:
-            epsilon = epsilons[1]
-        elif i > n_train * 2/4:
-            epsilon = epsilons[2]
-        elif i > n_train * 3/4:
-            epsilon = epsilons[3]
-        elif i > n_train:
-            epsilon = epsilons[4]
-        
-        thisGame = Game()
-
-        epochs, penalties, reward, = 0, 0, 0
-        game_over = False
-        visited_count = 0
-        moves_made = 0
-        
-        while (not game_over) and (visited_count < 100):
-            state = thisGame.current_state()
-
-            assert thisGame.check_state(), thisGame.state_to_str()
+    first = 1
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        q_table, last, n_win_train, n_win_test = load_checkpoint(checkpoint)
+        first = last + 1
+        print("Resuming from episode {}".format(first))
+    metrics_log = None
+    buffer = None
+    if replay_capacity is not None:
+        buffer = ReplayBuffer(replay_capacity, prioritized=prioritized)
+    if metrics is not None:
+        metrics_log = MetricsLog(metrics, window, resume_from=first - 1 if first > 1 else None)
 
-            current_actions = thisGame.get_valid_moves()
+    for i in range(first, n_train + n_test):
+        epsilon = get_epsilon(i, epsilons, n_train)
 
-            if (random.uniform(0, 1) < epsilon) or (state not in q_table):
-                action_i = np.random.choice(range(len(current_actions))) # Explore action space
-                action = current_actions[action_i]
-            else:
-                possible_known_actions = [
-                    a for a in q_table[state].keys() if a in current_actions
-                ]
-                if len(possible_known_actions) == 0:
-                    action_i = np.random.choice(range(len(current_actions)))
-                    action = current_actions[action_i]
-                else:
-                    best_action = np.argmax([q_table[state][a] for a in possible_known_actions])
-                    action = possible_known_actions[best_action] # Exploit learned values
-
-            next_state, reward, move_made, game_over, win, visited = thisGame.step(action) 
-            
-            if not move_made: continue
-            if visited:
-                visited_count += 1
-                thisGame.undo_move()
-                continue
-
-            moves_made += 1
-            
-            old_value = get_q_value(q_table, state, action)
-            next_max = 0
-            if next_state in q_table:
-                next_max = np.max(list(q_table[state].values()))
-            
-            # print(old_value, reward, next_max)
-            new_value = (1 - alpha) * old_value + alpha * (reward + gamma * next_max)
-            q_table[state, action] = new_value
-
-            if reward in [-10, -100]:
-                penalties += 1
-
-            state = next_state
+        deal = deals[(i - 1) % len(deals)] if deals is not None else None
+        if buffer is None:
+            moves_made, win, distance = episode(q_table, epsilon, alpha, gamma, deal=deal, profiler=profiler,
+                                                termination=termination)
+        else:
+            transitions = []
+            moves_made, win, distance = episode(q_table, epsilon, alpha, gamma, learn=False,
+                                                transitions=transitions, deal=deal, profiler=profiler,
+                                                termination=termination)
+            if len(transitions) > 0:
+                states, actions, rewards, next_states = zip(*transitions)
+                buffer.add(np.array([q_table.state_id(s) for s in states]), np.array(actions),
+                           np.array(rewards, dtype=np.float32), np.array([q_table.state_id(s) for s in next_states]))
+                n_batches = int(np.ceil(replay_ratio * len(transitions) / batch_size))
+                learn(q_table, buffer, n_batches, batch_size, alpha, gamma)
         
-            epochs += 1
-        
-        all_total_moves.append(moves_made)
-        all_win_loss.append(win)
-        how_far_from_win.append(
-            52 - sum([len(p.cards) for k, p in thisGame.blockPiles.items()])
-            )
+        if metrics_log is not None:
+            metrics_log.log(i, win, moves_made, distance, epsilon)
+        else:
+            all_total_moves.append(moves_made)
+            all_win_loss.append(win)
+            how_far_from_win.append(distance)
         if win: 
             if i <= n_train:
                 n_win_train += 1
             else:
                 n_win_test += 1
 
+        if checkpoint is not None and i % checkpoint_every == 0:
+            checkpoint_to(checkpoint, q_table, i, n_win_train, n_win_test)
+
         if i % 1 == 0:
             #clear_output(wait=True)
             if win:
@@ -127,25 +265,26 @@ def main(epsilons, n_train, n_test, filename=None, save=False):
             else:
                 print(f"Episode: {i} /--/ Moves to end {moves_made}")
 
-    all_win_loss = np.array(all_win_loss)
-    all_total_moves = np.array(all_total_moves)
-    how_far_from_win = np.array(how_far_from_win)
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, q_table, n_train + n_test - 1, n_win_train, n_win_test)
+    if metrics_log is not None:
+        metrics_log.close()
+        all_total_moves, all_win_loss, how_far_from_win = read_metrics(metrics)
 
-    print("Training finished.\n")
-    print("Won {} games in train and {} in test".format(n_win_train, n_win_test))
-    print("Mean number of moves for winning games: {}".format(
-        np.mean(all_total_moves[all_win_loss == True])
-        ))
-    print("Mean number of moves for losing games: {}".format(
-        np.mean(all_total_moves[all_win_loss == False])
-        ))
-    print("Mean distance from win: {}".format(
-        np.mean(how_far_from_win[all_win_loss == False])
-        ))
+    all_total_moves, all_win_loss, how_far_from_win = report(
+        all_total_moves, all_win_loss, how_far_from_win, n_win_train, n_win_test)
+    if termination is not None:
+        print("Episodes ended early: {}".format(termination.counts))
 
     if save == True:
         with open(filename, "wb") as f:
             pickle.dump((q_table, all_total_moves, all_win_loss, how_far_from_win), f)
+
+    if profiler is not None:
+        print(profiler.summary())
+    if cprofile is not None:
+        cprofile.disable()
+        cprofile.dump_stats(profile_output)
     
 if __name__ == "__main__":
     # hyperparams
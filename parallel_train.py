@@ -0,0 +1,134 @@
+import argparse
+import multiprocessing
+import pickle
+import random
+import time
+
+import numpy as np
+
+from main import get_epsilon, play_episode, update_q_value, report
+from qtable import QTable
+from deals import load_corpus
+
+# Self-play over a process pool. Every round the learner sends its Q-table
+# to the workers, each worker plays its share of the round's episodes
+# acting on that snapshot, and the learner applies the returned
+# (state, action, reward, next_state) updates in episode order.
+#
+# With a seed, episode i always uses seed + i for its deal and its moves, so
+# results depend on seed and sync_every but not on the number of workers.
+# With a deal corpus (see deals.py), episode i plays deal i - 1 instead.
+
+ALPHA = 0.2
+GAMMA = 0.9
+
+
+def run_episodes(args):
+    q_table, episodes, epsilons, n_train, seed, deals_path = args
+    deals = load_corpus(deals_path) if deals_path is not None else None
+    results = []
+    for i in episodes:
+        game_seed = None
+        if seed is not None:
+            game_seed = seed + i
+            random.seed(seed + i)
+            np.random.seed((seed + i) % 2**32)
+        deal = deals[(i - 1) % len(deals)] if deals is not None else None
+        transitions = []
+        moves_made, win, distance = play_episode(
+            q_table, get_epsilon(i, epsilons, n_train), ALPHA, GAMMA,
+            learn=False, transitions=transitions, seed=game_seed, deal=deal)
+        results.append((i, transitions, moves_made, win, distance))
+    return results
+
+
+def train_parallel(epsilons, n_train, n_test, n_workers=4, sync_every=None, seed=None,
+                   filename=None, save=False, verbose=True, deals_path=None):
+    # sync_every: episodes played on one Q-table snapshot (default: 10 per worker)
+    if sync_every is None:
+        sync_every = 10 * n_workers
+    if seed is not None:
+        np.random.seed(seed)
+
+    q_table = QTable()
+
+    all_total_moves = []
+    all_win_loss = []
+    how_far_from_win = []
+    n_win_train = 0
+    n_win_test = 0
+
+    episodes = list(range(1, n_train + n_test))
+    with multiprocessing.Pool(n_workers) as pool:
+        for start in range(0, len(episodes), sync_every):
+            batch = episodes[start:start + sync_every]
+            chunks = [batch[w::n_workers] for w in range(n_workers)]
+            jobs = [(q_table, chunk, epsilons, n_train, seed, deals_path) for chunk in chunks if len(chunk) > 0]
+
+            results = [r for worker_results in pool.map(run_episodes, jobs) for r in worker_results]
+            for i, transitions, moves_made, win, distance in sorted(results, key=lambda r: r[0]):
+                for state, action, reward, next_state in transitions:
+                    update_q_value(q_table, state, action, reward, next_state, ALPHA, GAMMA)
+
+                all_total_moves.append(moves_made)
+                all_win_loss.append(win)
+                how_far_from_win.append(distance)
+                if win:
+                    if i <= n_train:
+                        n_win_train += 1
+                    else:
+                        n_win_test += 1
+
+            if verbose:
+                print("Episodes {}-{} /--/ {} wins so far".format(
+                    batch[0], batch[-1], n_win_train + n_win_test))
+
+    all_total_moves, all_win_loss, how_far_from_win = report(
+        all_total_moves, all_win_loss, how_far_from_win, n_win_train, n_win_test)
+
+    if save == True:
+        with open(filename, "wb") as f:
+            pickle.dump((q_table, all_total_moves, all_win_loss, how_far_from_win), f)
+
+    return q_table, all_total_moves, all_win_loss, how_far_from_win
+
+
+def benchmark_scaling(max_workers, n_episodes=200, seed=0):
+    # episodes/sec for 1..max_workers processes on the same seeded episodes
+    epsilons = [0.9, 0.9, 0.7, 0.5, 0.1]
+    rows = []
+    for n_workers in range(1, max_workers + 1):
+        start = time.time()
+        train_parallel(epsilons, n_episodes, 1, n_workers=n_workers, sync_every=4 * max_workers,
+                       seed=seed, verbose=False)
+        elapsed = time.time() - start
+        rows.append((n_workers, elapsed, n_episodes / elapsed))
+
+    print("workers  seconds  episodes/s  speedup")
+    for n_workers, elapsed, rate in rows:
+        print("{:7d}  {:7.2f}  {:10.1f}  {:7.2f}".format(n_workers, elapsed, rate, rate / rows[0][2]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--n-train", type=int, default=20000)
+    parser.add_argument("--n-test", type=int, default=5000)
+    parser.add_argument("--sync-every", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--filename", default=None)
+    parser.add_argument("--deals", default=None, help="deal corpus written by deals.py")
+    parser.add_argument("--scaling", action="store_true", help="run the 1..workers scaling benchmark")
+    parser.add_argument("--episodes", type=int, default=200, help="episodes per scaling run")
+    args = parser.parse_args()
+
+    if args.scaling:
+        benchmark_scaling(args.workers, args.episodes, seed=args.seed or 0)
+    else:
+        epsilons = [0.9, 0.9, 0.7, 0.5, 0.1]
+        start = time.time()
+        train_parallel(epsilons, args.n_train, args.n_test, n_workers=args.workers,
+                       sync_every=args.sync_every, seed=args.seed,
+                       filename=args.filename, save=args.filename is not None, deals_path=args.deals)
+        print("Time elapsed: {} minutes".format((time.time() - start)/60))
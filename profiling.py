@@ -0,0 +1,55 @@
+import argparse
+import time
+
+# Opt-in per-phase timers. Profiler.wrap returns a function that counts the
+# calls of f and adds up their time in nanoseconds; Game(profiler=...) binds
+# wrapped versions of its step phases at construction (see
+# Game.PROFILED), so a Game without a profiler runs the plain methods.
+# Times are inclusive: step contains do_move, game_over contains
+# get_valid_moves, ...
+
+
+class Profiler:
+
+    def __init__(self):
+        self.calls = {}
+        self.ns = {}
+
+    def wrap(self, name, f):
+        calls, ns = self.calls, self.ns
+        calls.setdefault(name, 0)
+        ns.setdefault(name, 0)
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                ns[name] += clock() - start
+                calls[name] += 1
+        return timed
+
+    def summary(self):
+        total = max(self.ns.values(), default=0) or 1
+        lines = ["{:20s} {:>10s} {:>12s} {:>10s} {:>7s}".format("phase", "calls", "total ms", "us/call", "%")]
+        for name in sorted(self.ns, key=self.ns.get, reverse=True):
+            if self.calls[name] == 0: continue
+            calls, ns = self.calls[name], self.ns[name]
+            lines.append("{:20s} {:10d} {:12.1f} {:10.2f} {:6.1f}%".format(
+                name, calls, ns / 1e6, ns / calls / 1000, 100 * ns / total))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # profile a short training run without touching the source
+    parser = argparse.ArgumentParser(description="Profile main.main")
+    parser.add_argument("--n-train", type=int, default=200)
+    parser.add_argument("--n-test", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cprofile", default=None, help="also write a cProfile pstats file")
+    args = parser.parse_args()
+
+    import main
+    main.main([0.9, 0.9, 0.7, 0.5, 0.1], args.n_train, args.n_test, seed=args.seed,
+              profile=True, profile_output=args.cprofile)
@@ -0,0 +1,205 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from solitaire import Game, STATE_FACE_UP, N_STATE_FEATURES, N_ACTIONS
+from main import get_epsilon, report
+from deals import load_corpus
+
+# Q-learning with a function approximator instead of a table: a linear
+# model or a one-hidden-layer ReLU MLP from a fixed-length feature vector
+# to the Q-values of all N_ACTIONS action ids. Memory is the weights, no
+# matter how many states are seen. Every episode's transitions are learnt
+# from in minibatches, with batched forward and backward passes and Adam.
+
+N_FEATURES = N_STATE_FEATURES[STATE_FACE_UP] + 2
+
+
+def features(game):
+    # sorted foundation heights, play pile lengths and face-up counts
+    # (Game.state_features(STATE_FACE_UP)) + stock and side pile sizes,
+    # scaled to about [0, 1]
+    counts = game.state_features(STATE_FACE_UP)
+    x = np.empty(N_FEATURES, dtype=np.float32)
+    x[:len(counts)] = counts
+    x[-2] = len(game.deck.cards)
+    x[-1] = len(game.deck.side_pile)
+    x /= 13
+    return x
+
+
+class QNetwork:
+
+    def __init__(self, n_features=N_FEATURES, n_actions=N_ACTIONS, hidden=64, lr=1e-3, seed=None):
+        # hidden: size of the hidden layer, 0 for a linear model
+        rng = np.random.default_rng(seed)
+        self.hidden = hidden
+        self.lr = lr
+        if hidden:
+            self.params = {
+                "W1": (rng.standard_normal((n_features, hidden)) * np.sqrt(2 / n_features)).astype(np.float32),
+                "b1": np.zeros(hidden, dtype=np.float32),
+                "W2": (rng.standard_normal((hidden, n_actions)) * np.sqrt(1 / hidden)).astype(np.float32),
+                "b2": np.zeros(n_actions, dtype=np.float32),
+            }
+        else:
+            self.params = {
+                "W2": np.zeros((n_features, n_actions), dtype=np.float32),
+                "b2": np.zeros(n_actions, dtype=np.float32),
+            }
+        # Adam moments
+        self.m = {k: np.zeros_like(v) for k, v in self.params.items()}
+        self.v = {k: np.zeros_like(v) for k, v in self.params.items()}
+        self.t = 0
+
+    def forward(self, X):
+        # (batch, n_features) -> (batch, n_actions), and the hidden activations
+        p = self.params
+        h = np.maximum(X @ p["W1"] + p["b1"], 0) if self.hidden else X
+        return h @ p["W2"] + p["b2"], h
+
+    def q_values(self, x):
+        return self.forward(x[None])[0][0]
+
+    def best_action(self, x, mask):
+        # highest valued action id allowed by an N_ACTIONS mask
+        return int(np.argmax(np.where(mask, self.q_values(x), -np.inf)))
+
+    def max_q(self, X, masks):
+        # max over the allowed actions of each row, 0 for rows with none
+        q = np.where(masks, self.forward(X)[0], -np.inf).max(axis=1)
+        q[~masks.any(axis=1)] = 0
+        return q
+
+    def train_batch(self, X, actions, targets):
+        # one Adam step on the squared error of Q(X, actions) against
+        # targets; returns the mean loss
+        p = self.params
+        q, h = self.forward(X)
+        rows = np.arange(len(X))
+        error = q[rows, actions] - targets
+        dq = np.zeros_like(q)
+        dq[rows, actions] = error / len(X)
+
+        grads = {"W2": h.T @ dq, "b2": dq.sum(axis=0)}
+        if self.hidden:
+            dh = (dq @ p["W2"].T) * (h > 0)
+            grads["W1"] = X.T @ dh
+            grads["b1"] = dh.sum(axis=0)
+
+        self.t += 1
+        for k, g in grads.items():
+            self.m[k] = 0.9 * self.m[k] + 0.1 * g
+            self.v[k] = 0.999 * self.v[k] + 0.001 * g * g
+            m_hat = self.m[k] / (1 - 0.9 ** self.t)
+            v_hat = self.v[k] / (1 - 0.999 ** self.t)
+            p[k] -= (self.lr * m_hat / (np.sqrt(v_hat) + 1e-8)).astype(np.float32)
+        return float(np.mean(error ** 2) / 2)
+
+    def nbytes(self):
+        return sum(v.nbytes for v in self.params.values()) * 3 # + Adam moments
+
+
+def play_episode(qnet, epsilon, transitions, seed=None, deal=None):
+    # like main.play_episode; transitions gets (features, action id, reward,
+    # next features, next action mask, game over) tuples
+    game = Game(seed=seed, deal=deal)
+    game_over = False
+    win = False
+    visited_count = 0
+    moves_made = 0
+
+    x = features(game)
+    while (not game_over) and (visited_count < 100):
+        action_ids = game.valid_action_ids()
+        if random.uniform(0, 1) < epsilon:
+            action = int(action_ids[np.random.randint(len(action_ids))])
+        else:
+            action = qnet.best_action(x, game.action_mask())
+
+        _, reward, move_made, game_over, win, visited = game.step_id(action)
+        if not move_made: continue
+        if visited:
+            visited_count += 1
+            game.undo_move()
+            continue
+
+        moves_made += 1
+        next_x = features(game)
+        transitions.append((x, action, reward, next_x, game.action_mask().copy(), game_over))
+        x = next_x
+
+    how_far_from_win = 52 - sum([len(p.cards) for k, p in game.blockPiles.items()])
+    return moves_made, win, how_far_from_win
+
+
+def learn(qnet, transitions, gamma, batch_size):
+    # minibatch updates over one episode's transitions, in a random order
+    X, actions, rewards, next_X, next_masks, dones = (np.array(v) for v in zip(*transitions))
+    targets = rewards + gamma * np.where(dones, 0, qnet.max_q(next_X, next_masks))
+    order = np.random.permutation(len(X))
+    losses = []
+    for start in range(0, len(X), batch_size):
+        batch = order[start:start + batch_size]
+        losses.append(qnet.train_batch(X[batch], actions[batch], targets[batch].astype(np.float32)))
+    return np.mean(losses)
+
+
+def train(epsilons, n_train, n_test, hidden=64, lr=1e-3, gamma=0.9, batch_size=256, seed=None,
+          deals_path=None, verbose=True):
+    # same episodes and epsilon schedule as main.main
+    deals = load_corpus(deals_path) if deals_path is not None else None
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    qnet = QNetwork(hidden=hidden, lr=lr, seed=seed)
+
+    all_total_moves = []
+    all_win_loss = []
+    how_far_from_win = []
+    n_win_train = 0
+    n_win_test = 0
+
+    for i in range(1, n_train + n_test):
+        epsilon = get_epsilon(i, epsilons, n_train)
+        deal = deals[(i - 1) % len(deals)] if deals is not None else None
+        transitions = []
+        moves_made, win, distance = play_episode(qnet, epsilon, transitions, deal=deal)
+        loss = learn(qnet, transitions, gamma, batch_size) if transitions else 0.0
+
+        all_total_moves.append(moves_made)
+        all_win_loss.append(win)
+        how_far_from_win.append(distance)
+        if win:
+            if i <= n_train:
+                n_win_train += 1
+            else:
+                n_win_test += 1
+
+        if verbose:
+            print("Episode: {} /--/ Moves to end {} /--/ loss {:.3f}{}".format(
+                i, moves_made, loss, " /--/ WIN" if win else ""))
+
+    all_total_moves, all_win_loss, how_far_from_win = report(
+        all_total_moves, all_win_loss, how_far_from_win, n_win_train, n_win_test)
+    return qnet, all_total_moves, all_win_loss, how_far_from_win
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Q-learning with a linear / MLP Q-function")
+    parser.add_argument("--n-train", type=int, default=20000)
+    parser.add_argument("--n-test", type=int, default=5000)
+    parser.add_argument("--hidden", type=int, default=64, help="hidden units, 0 for a linear model")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--deals", default=None, help="deal corpus written by deals.py")
+    args = parser.parse_args()
+
+    epsilons = [0.9, 0.9, 0.7, 0.5, 0.1]
+    start = time.time()
+    train(epsilons, args.n_train, args.n_test, args.hidden, args.lr, batch_size=args.batch_size,
+          seed=args.seed, deals_path=args.deals)
+    print("Time elapsed: {} minutes".format((time.time() - start)/60))
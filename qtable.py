@@ -0,0 +1,487 @@
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+
+from solitaire import N_ACTIONS, move_to_action
+
+# Q-values for interned states x fixed action ids (see solitaire.ACTION_MOVES).
+# Only the entries that have been set are stored, like the keys of the old
+# dict of dicts: the entries of a state are a block of slots in two shared
+# pools, actions[start:start + size] and values[start:start + size], kept
+# sorted by action id so a state's max and argmax are numpy reductions over
+# its block. A block that fills up moves to the end of the pools with twice
+# the room, and the pools are packed again when they run out.
+
+
+# Saved tables (QTable.save / load_qtable) are one flat file: the magic
+# bytes, the length of a JSON header, the header, then the arrays, each
+# 64-byte aligned so they can be opened with numpy.memmap:
+#   keys     sorted state keys (see keys_to_array)
+#   indptr   entries of keys[i] are indptr[i]:indptr[i + 1]
+#   actions  int16 action ids, sorted within a state
+#   values   float32 Q-values
+# A lookup is a binary search in keys and a slice, nothing is parsed.
+
+MAGIC = b"QTABLE01"
+ALIGN = 64
+
+
+def keys_to_array(keys):
+    # state keys (ints from Game.encode_state, or the bytes of STATE_FULL)
+    # as fixed-width big-endian byte strings
+    if len(keys) > 0 and isinstance(keys[0], bytes):
+        return np.array(keys, dtype="S{}".format(max(len(k) for k in keys))), "bytes"
+    width = max([(k.bit_length() + 7) // 8 for k in keys] + [1])
+    return np.array([k.to_bytes(width, "big") for k in keys], dtype="S{}".format(width)), "int"
+
+def array_to_keys(array, kind):
+    # numpy drops trailing zero bytes of "S" items, pad them back
+    width = array.dtype.itemsize
+    if kind == "bytes":
+        return [k.ljust(width, b"\0") for k in array.tolist()]
+    return [int.from_bytes(k.ljust(width, b"\0"), "big") for k in array.tolist()]
+
+
+class QLookup:
+
+    # max / best action queries over entries(state), the (action ids,
+    # values) known for a state, sorted by action id
+
+    def max(self, state):
+        # max over the known actions of a state, 0 if there are none
+        _, values = self.entries(state)
+        return values.max() if len(values) > 0 else 0
+
+    def best_action(self, state, actions):
+        # known action with the highest value among the given action ids
+        # (the first given one on ties), -1 if none of them is known
+        known_actions, values = self.entries(state)
+        if len(known_actions) == 0:
+            return -1
+        actions = np.asarray(actions)
+        pos = np.minimum(np.searchsorted(known_actions, actions), len(known_actions) - 1)
+        known = known_actions[pos] == actions
+        if not known.any():
+            return -1
+        return int(actions[np.argmax(np.where(known, values[pos], -np.inf))])
+
+    def best_masked(self, state, mask):
+        # known action with the highest value among the True entries of an
+        # N_ACTIONS mask (lowest id on ties), -1 if none of them is known
+        known_actions, values = self.entries(state)
+        allowed = mask[known_actions]
+        if not allowed.any():
+            return -1
+        return int(known_actions[np.argmax(np.where(allowed, values, -np.inf))])
+
+
+class QTable(QLookup):
+
+    def __init__(self, n_actions=N_ACTIONS, capacity=1024):
+        self.n_actions = n_actions
+        self.state_ids = {} # state key -> row
+        self.states = [] # row -> state key
+        # per row: first slot, entries and slots of its block
+        self.start = np.zeros(capacity, dtype=np.int64)
+        self.size = np.zeros(capacity, dtype=np.int32)
+        self.room = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(2 * capacity, dtype=np.int16)
+        self.values = np.zeros(2 * capacity, dtype=np.float32)
+        self.used = 0 # slots handed out to blocks
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, state):
+        return state in self.state_ids
+
+    def __getstate__(self):
+        # only pickle the entries, packed
+        slots, sizes = self.block_slots(np.arange(len(self.states)))
+        return {
+            "n_actions": self.n_actions,
+            "states": self.states,
+            "sizes": sizes,
+            "actions": self.actions[slots],
+            "values": self.values[slots],
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["n_actions"], capacity=max(1, len(state["states"])))
+        self.fill(state["states"], state["sizes"], state["actions"], state["values"])
+
+    def fill(self, states, sizes, actions, values):
+        # load states with sizes[i] entries each; actions / values are the
+        # entries of every state in turn, sorted by action within a state
+        n = len(states)
+        self.states = list(states)
+        self.state_ids = {s: i for i, s in enumerate(self.states)}
+        self.size[:n] = sizes
+        self.room[:n] = sizes
+        self.start[1:n] = np.cumsum(sizes)[:-1]
+        self.used = int(np.sum(sizes))
+        self.actions = np.zeros(max(1, 2 * self.used), dtype=np.int16)
+        self.values = np.zeros(max(1, 2 * self.used), dtype=np.float32)
+        self.actions[:self.used] = actions
+        self.values[:self.used] = values
+
+    def to_arrays(self):
+        # the known entries as flat arrays: keys[rows[i]], actions[i] -> values[i]
+        n = len(self.states)
+        keys, kind = keys_to_array(self.states)
+        slots, sizes = self.block_slots(np.arange(n))
+        return {
+            "keys": keys,
+            "key_kind": np.array(kind),
+            "rows": np.repeat(np.arange(n, dtype=np.int64), sizes),
+            "actions": self.actions[slots],
+            "values": self.values[slots],
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, n_actions=N_ACTIONS):
+        keys = array_to_keys(arrays["keys"], str(arrays["key_kind"]))
+        rows, actions = np.asarray(arrays["rows"]), np.asarray(arrays["actions"])
+        order = np.lexsort((actions, rows))
+        q_table = cls(n_actions, capacity=max(1, len(keys)))
+        q_table.fill(keys, np.bincount(rows, minlength=len(keys)), actions[order],
+                     np.asarray(arrays["values"])[order])
+        return q_table
+
+    @classmethod
+    def from_dict(cls, q_dict, n_actions=N_ACTIONS):
+        # the dict main.main used to train: {current_state string: {move
+        # tuple: value}} holds the starting values it looked up, and the
+        # {(current_state string, move tuple): value} entries it wrote the
+        # learned values to, which take over from them
+        q_table = cls(n_actions, capacity=max(1, len(q_dict)))
+        key = lambda state: lengths_key(state) if isinstance(state, str) else state
+        action = lambda move: move_to_action(move) if isinstance(move, tuple) else move
+        learned = []
+        for k, v in q_dict.items():
+            if isinstance(k, tuple):
+                learned.append((k, v))
+                continue
+            for move, value in v.items():
+                q_table.set(key(k), action(move), value)
+        for (state, move), value in learned:
+            q_table.set(key(state), action(move), value)
+        return q_table
+
+    def save(self, path):
+        # written to a temporary file and moved into place
+        arrays = self.to_arrays()
+        order = np.argsort(arrays["keys"], kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        rows = rank[arrays["rows"]]
+        entries = np.lexsort((arrays["actions"], rows))
+        counts = np.bincount(rows, minlength=len(order))
+        indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        write_table(path, {
+            "keys": arrays["keys"][order],
+            "indptr": indptr,
+            "actions": arrays["actions"][entries],
+            "values": arrays["values"][entries],
+        }, str(arrays["key_kind"]), self.n_actions)
+
+    def state_id(self, state, create=True):
+        # dense row of a state, -1 if it's unknown and create is False
+        sid = self.state_ids.get(state)
+        if sid is None:
+            if not create:
+                return -1
+            sid = len(self.states)
+            if sid == len(self.start):
+                self.grow()
+            self.start[sid] = self.used
+            self.state_ids[state] = sid
+            self.states.append(state)
+        return sid
+
+    def grow(self):
+        capacity = max(1, 2 * len(self.start))
+        for name in ("start", "size", "room"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def block_slots(self, rows):
+        # slots of every entry of the given rows, one block after the
+        # other, and the number of entries of each row
+        sizes = self.size[rows].astype(np.int64)
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        return np.repeat(self.start[rows], sizes) + offsets, sizes
+
+    def entries(self, state):
+        sid = self.state_ids.get(state)
+        if sid is None:
+            return self.actions[:0], self.values[:0]
+        lo = self.start[sid]
+        hi = lo + self.size[sid]
+        return self.actions[lo:hi], self.values[lo:hi]
+
+    def find(self, sid, action):
+        # slot of an entry, -1 if it isn't known
+        lo = int(self.start[sid])
+        hi = lo + int(self.size[sid])
+        i = lo + int(np.searchsorted(self.actions[lo:hi], action))
+        if i < hi and self.actions[i] == action:
+            return i
+        return -1
+
+    def find_all(self, rows, actions):
+        # find on arrays of rows and actions: a binary search in every
+        # block at once
+        lo = self.start[rows]
+        end = lo + self.size[rows]
+        hi = end
+        last = len(self.actions) - 1
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            right = active & (self.actions[np.minimum(mid, last)] < actions)
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+        found = (lo < end) & (self.actions[np.minimum(lo, last)] == actions)
+        return np.where(found, lo, -1)
+
+    def insert(self, sid, action, value):
+        # new entry of a row, kept in action order; returns its slot
+        n = int(self.size[sid])
+        if n == self.room[sid]:
+            self.move_block(sid, max(2, 2 * n))
+        lo = int(self.start[sid])
+        i = lo + int(np.searchsorted(self.actions[lo:lo + n], action))
+        self.actions[i + 1:lo + n + 1] = self.actions[i:lo + n]
+        self.values[i + 1:lo + n + 1] = self.values[i:lo + n]
+        self.actions[i] = action
+        self.values[i] = value
+        self.size[sid] = n + 1
+        return i
+
+    def move_block(self, sid, room):
+        # give a row a block of room slots at the end of the pools
+        if self.used + room > len(self.actions):
+            self.pack(room)
+        lo, n = int(self.start[sid]), int(self.size[sid])
+        self.actions[self.used:self.used + n] = self.actions[lo:lo + n]
+        self.values[self.used:self.used + n] = self.values[lo:lo + n]
+        self.start[sid] = self.used
+        self.room[sid] = room
+        self.used += room
+
+    def pack(self, extra):
+        # move the blocks next to each other in row order, dropping the
+        # slots left behind by moved blocks, into pools with room for at
+        # least extra more slots
+        n = len(self.states)
+        room = self.room[:n].astype(np.int64)
+        start = np.zeros(n, dtype=np.int64)
+        start[1:] = np.cumsum(room)[:-1]
+        used = int(room.sum())
+        capacity = max(len(self.actions), 2 * (used + extra))
+        slots, sizes = self.block_slots(np.arange(n))
+        new_slots = slots - np.repeat(self.start[:n] - start, sizes)
+        actions = np.zeros(capacity, dtype=np.int16)
+        values = np.zeros(capacity, dtype=np.float32)
+        actions[new_slots] = self.actions[slots]
+        values[new_slots] = self.values[slots]
+        self.actions, self.values = actions, values
+        self.start[:n] = start
+        self.used = used
+
+    def get(self, state, action):
+        # unseen entries start at a random integer in [-3, 3)
+        sid = self.state_id(state)
+        slot = self.find(sid, action)
+        if slot == -1:
+            slot = self.insert(sid, action, np.random.randint(-3, 3))
+        return self.values[slot]
+
+    def set(self, state, action, value):
+        sid = self.state_id(state)
+        slot = self.find(sid, action)
+        if slot == -1:
+            self.insert(sid, action, value)
+        else:
+            self.values[slot] = value
+
+    def update_batch(self, rows, actions, rewards, next_rows, alpha, gamma):
+        # main.update_q_value on arrays of state rows (see state_id), with a
+        # scalar or per-sample alpha; returns the TD errors. A (row, action)
+        # pair repeated in the batch keeps the last of its updates
+        slots = self.find_all(rows, actions)
+        unknown = slots == -1
+        if unknown.any():
+            for row, action, value in zip(rows[unknown], actions[unknown],
+                                          np.random.randint(-3, 3, size=unknown.sum())):
+                slot = self.find(row, action)
+                if slot == -1:
+                    self.insert(row, action, value)
+                else:
+                    self.values[slot] = value
+            slots = self.find_all(rows, actions)
+        old = self.values[slots]
+        next_slots, sizes = self.block_slots(next_rows)
+        next_max = np.zeros(len(next_rows), dtype=np.float32)
+        known_next = sizes > 0
+        if known_next.any():
+            firsts = (np.cumsum(sizes) - sizes)[known_next]
+            next_max[known_next] = np.maximum.reduceat(self.values[next_slots], firsts)
+        target = rewards + gamma * next_max
+        self.values[slots] = (1 - alpha) * old + alpha * target
+        return target - old
+
+    def nbytes(self):
+        n = len(self.states)
+        return (self.start[:n].nbytes + self.size[:n].nbytes + self.room[:n].nbytes
+                + self.actions[:self.used].nbytes + self.values[:self.used].nbytes)
+
+
+def write_table(path, arrays, key_kind, n_actions):
+    header = {"key_kind": key_kind, "n_actions": n_actions, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        header["arrays"][name] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + len(header_bytes).to_bytes(8, "little") + header_bytes)
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_qtable(path, mmap=True):
+    # a FrozenQTable over a file written by QTable.save; with mmap the
+    # arrays are paged in on demand instead of read up front
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a saved Q-table".format(path))
+        size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(size))
+    start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        if mmap and np.prod(shape) > 0:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=start + offset, shape=tuple(shape))
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                                       offset=start + offset).reshape(shape)
+    return FrozenQTable(arrays, header["key_kind"], header["n_actions"])
+
+
+class FrozenQTable(QLookup):
+
+    # read-only QTable over the arrays of a saved table, for evaluation
+
+    def __init__(self, arrays, key_kind, n_actions=N_ACTIONS):
+        self.keys = arrays["keys"]
+        self.indptr = arrays["indptr"]
+        self.actions = arrays["actions"]
+        self.values = arrays["values"]
+        self.key_kind = key_kind
+        self.n_actions = n_actions
+        self.width = self.keys.dtype.itemsize
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, state):
+        return self.state_id(state) != -1
+
+    def key_bytes(self, state):
+        if self.key_kind == "bytes":
+            return state if len(state) == self.width else None
+        if state < 0 or state.bit_length() > 8 * self.width:
+            return None
+        return state.to_bytes(self.width, "big")
+
+    def state_id(self, state, create=False):
+        # row of a state, -1 if it's not in the table
+        key = self.key_bytes(state)
+        if key is None or len(self.keys) == 0:
+            return -1
+        key = np.array(key, dtype=self.keys.dtype)
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def entries(self, state):
+        # (action ids, values) known for a state
+        sid = self.state_id(state)
+        if sid == -1:
+            return self.actions[:0], self.values[:0]
+        lo, hi = self.indptr[sid], self.indptr[sid + 1]
+        return self.actions[lo:hi], self.values[lo:hi]
+
+    def get(self, state, action):
+        # 0 for entries that were never set
+        actions, values = self.entries(state)
+        i = np.searchsorted(actions, action)
+        if i < len(actions) and actions[i] == action:
+            return values[i]
+        return 0.0
+
+    def to_qtable(self):
+        rows = np.repeat(np.arange(len(self.keys)), np.diff(self.indptr))
+        return QTable.from_arrays({"keys": np.asarray(self.keys), "key_kind": np.array(self.key_kind),
+                                   "rows": rows, "actions": np.asarray(self.actions),
+                                   "values": np.asarray(self.values)}, self.n_actions)
+
+
+def lengths_key(state):
+    # old "b,b,b,b/p,p,p,p,p,p,p" current_state string -> Game.encode_state(STATE_LENGTHS)
+    blocks, piles = state.split("/")
+    key = 0
+    for l in blocks.split(","):
+        key = (key << 4) | int(l)
+    for l in piles.split(","):
+        key = (key << 5) | int(l)
+    return key
+
+
+def load_pickle(path):
+    # QTable of a main.main / train_parallel pickle (q_table, moves, wins,
+    # distances); q_table is a QTable or the old dict (see QTable.from_dict)
+    with open(path, "rb") as f:
+        obj = pickle.load(f)
+    if isinstance(obj, tuple):
+        obj = obj[0]
+    if isinstance(obj, dict):
+        obj = QTable.from_dict(obj)
+    return obj
+
+
+def convert_pickle(pickle_path, path):
+    # training pickle -> saved table
+    q_table = load_pickle(pickle_path)
+    q_table.save(path)
+    return q_table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a training pickle to a saved Q-table")
+    parser.add_argument("pickle")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    q_table = convert_pickle(args.pickle, args.output)
+    print("Wrote {} states to {}".format(len(q_table), args.output))
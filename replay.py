@@ -0,0 +1,82 @@
+import numpy as np
+
+# Experience replay for the tabular learner: a fixed-capacity ring of
+# (state row, action id, reward, next state row) transitions in NumPy
+# arrays, state rows being QTable.state_id of the encoded states. Once
+# full, new transitions overwrite the oldest ones, so memory stays at
+# nbytes() whatever the length of the run.
+#
+# With prioritized=True transitions are sampled with probability
+# proportional to (|TD error| + eps) ** alpha, new ones getting the current
+# max priority, and each sample comes with an importance weight
+# (N * P(i)) ** -beta, normalized by the largest, to scale its step size.
+
+
+class ReplayBuffer:
+
+    def __init__(self, capacity=100000, prioritized=False, alpha=0.6, beta=0.4, eps=1e-3):
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        self.max_priority = 1.0
+        self.next = 0 # slot the next transition goes to
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, states, actions, rewards, next_states):
+        # a batch of transitions, e.g. one episode
+        n = len(states)
+        if n == 0:
+            return
+        if n > self.capacity: # only the last capacity fit
+            states, actions, rewards, next_states = (
+                x[-self.capacity:] for x in (states, actions, rewards, next_states))
+            n = self.capacity
+        slots = (self.next + np.arange(n)) % self.capacity
+        self.states[slots] = states
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.next_states[slots] = next_states
+        self.priorities[slots] = self.max_priority
+        self.next = (self.next + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size):
+        # (slots, states, actions, rewards, next_states, weights)
+        if self.prioritized:
+            p = self.priorities[:self.size] ** self.alpha
+            p /= p.sum()
+            slots = np.random.choice(self.size, batch_size, p=p)
+            weights = (self.size * p[slots]) ** -self.beta
+            weights /= weights.max()
+        else:
+            slots = np.random.randint(self.size, size=batch_size)
+            weights = np.ones(batch_size)
+        return (slots, self.states[slots], self.actions[slots], self.rewards[slots],
+                self.next_states[slots], weights)
+
+    def update_priorities(self, slots, td_errors):
+        priorities = np.abs(td_errors) + self.eps
+        self.priorities[slots] = priorities
+        self.max_priority = max(self.max_priority, priorities.max())
+
+    def nbytes(self):
+        return sum(x.nbytes for x in (self.states, self.actions, self.rewards, self.next_states, self.priorities))
+
+
+def replay_updates(q_table, buffer, n_batches, batch_size, alpha, gamma):
+    # n_batches vectorized Q-learning steps on minibatches from buffer
+    for _ in range(n_batches):
+        slots, states, actions, rewards, next_states, weights = buffer.sample(batch_size)
+        td_errors = q_table.update_batch(states, actions, rewards, next_states, alpha * weights, gamma)
+        if buffer.prioritized:
+            buffer.update_priorities(slots, td_errors)
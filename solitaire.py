@@ -1,6 +1,11 @@
-from card_elements import Card, Deck, Pile
+import itertools
+
+from card_elements import Card, Deck, LimitedDeck, Pile
 import numpy as np
 
+import zobrist
+from zobrist import BloomFilter
+
 VALUES = ["A","2","3","4","5","6","7","8","9","10","J","Q","K"]
     
 SUITS = { #keys are unicode symbols for suits
@@ -12,17 +17,225 @@ SUITS = { #keys are unicode symbols for suits
 
 NUM_PLAY_PILES = 7
 
+KING_RANK = len(VALUES) - 1
+
 VISITED = 1
 NOT_VISITED = 0
 
 TO_BLOCK = 1
 TO_PILE = 2
 DEAL_CARDS = 3
+FROM_BLOCK = 4 # (FROM_BLOCK, suit index, pile), RuleSet.foundation_to_tableau
+
+# fixed action ids for every move get_valid_moves can produce, in the same
+# order as the sections of get_valid_moves, then the moves of optional rules
+MAX_RUN = len(VALUES) - 1 # a run ending in a king can't be moved onto a pile
+
+ACTION_MOVES = (
+    [(TO_BLOCK, i, -1) for i in range(NUM_PLAY_PILES)]
+    + [(TO_BLOCK, -1, -1)]
+    + [(TO_PILE, j, i) for i in range(NUM_PLAY_PILES) for j in range(NUM_PLAY_PILES) if i != j]
+    + [(TO_PILE, -1, i) for i in range(NUM_PLAY_PILES)]
+    + [(TO_PILE, i, j, n) for i in range(NUM_PLAY_PILES) for j in range(NUM_PLAY_PILES) if i != j
+       for n in range(1, MAX_RUN + 1)]
+    + [(DEAL_CARDS, -1, -1)]
+    + [(FROM_BLOCK, s, i) for s in range(len(SUITS)) for i in range(NUM_PLAY_PILES)]
+)
+ACTION_IDS = {move: a for a, move in enumerate(ACTION_MOVES)}
+N_ACTIONS = len(ACTION_MOVES)
+
+def move_to_action(move):
+    return ACTION_IDS[move]
+
+def action_to_move(action):
+    return ACTION_MOVES[action]
+
+# per card code (suit index * 13 + rank) lookup tables, for the rule
+# checks of kernels.py, batch_game.py and Game.is_dead_end. Colors are
+# numbered like Card.color
+_codes = np.arange(len(VALUES) * len(SUITS))
+_colors = list(dict.fromkeys(SUITS.values()))
+CARD_RANK = (_codes % len(VALUES)).astype(np.int8)
+CARD_SUIT = (_codes // len(VALUES)).astype(np.int8)
+CARD_COLOR = np.array([_colors.index(color) for color in SUITS.values()], dtype=np.int8)[CARD_SUIT]
+
+# CAN_STACK[higher, lower]: Game.checkCardOrder(higher, lower)
+CAN_STACK = ((CARD_RANK[:, None] == CARD_RANK[None, :] + 1)
+             & (CARD_COLOR[:, None] != CARD_COLOR[None, :])
+             & (CARD_RANK[None, :] != KING_RANK))
+# STACKS_ON[code]: codes of the cards that can go on that card in a play
+# pile, one rank lower and of the other color
+STACKS_ON = [np.flatnonzero(row).tolist() for row in CAN_STACK]
+
+# rewards of Game.step, see RuleSet
+REWARDS = {
+    "to_block": 6, # move card to block pile: very good!
+    "to_pile": 2, # move card from deck to play pile, or a king to an empty pile
+    "per_card": 1, # move cards between play piles, per card
+    "deal": 0, # deal cards: neutral
+    "from_block": -6, # undoes a to_block
+    "win": 100,
+    "lose": -100,
+    "visited": -100,
+}
+
+
+class RuleSet:
+
+    # rule variants, fixed for the life of a Game, which resolves them once
+    # at construction (deck class, move generators, reward lookup)
+    # draw_count: cards dealt to the side pile at a time, 1 to 3 (the
+    # STATE_FULL features have room for 3 side cards)
+    # max_redeals: times the side pile can be turned over once the stock is
+    # gone through, None for no limit (the stock just keeps cycling)
+    # foundation_to_tableau: block pile tops can move back onto play piles
+    # rewards: overrides of REWARDS entries
+
+    def __init__(self, draw_count=3, max_redeals=None, foundation_to_tableau=False, rewards=None):
+        rewards = rewards or {}
+        unknown = set(rewards) - set(REWARDS)
+        if unknown:
+            raise ValueError("Unknown rewards: {}".format(", ".join(sorted(unknown))))
+        if draw_count not in (1, 2, 3):
+            raise ValueError("draw_count must be 1, 2 or 3: {}".format(draw_count))
+        self.draw_count = draw_count
+        self.max_redeals = max_redeals
+        self.foundation_to_tableau = foundation_to_tableau
+        self.rewards = dict(REWARDS, **rewards)
+        # reward of every action, looked up by Game.get_reward
+        self.move_rewards = {move: self.reward(move) for move in ACTION_MOVES}
+
+    def reward(self, move):
+        if move[0] == TO_BLOCK:
+            return self.rewards["to_block"]
+
+        if move[0] == TO_PILE:
+            if len(move) != 4:
+                return self.rewards["to_pile"]
+            else:
+                return self.rewards["per_card"] * move[3]
+
+        if move[0] == DEAL_CARDS:
+            return self.rewards["deal"]
+
+        if move[0] == FROM_BLOCK:
+            return self.rewards["from_block"]
+
+        return 0
+
+
+DEFAULT_RULES = RuleSet()
+
+# named variants, for Game(rules=name) and the benchmark
+RULE_SETS = {
+    "default": DEFAULT_RULES,
+    "draw1": RuleSet(draw_count=1),
+    "draw3-2redeals": RuleSet(max_redeals=2),
+    "draw1-0redeals": RuleSet(draw_count=1, max_redeals=0),
+    "foundation-to-tableau": RuleSet(foundation_to_tableau=True),
+}
+
+
+class TerminationPolicy:
+
+    # when Game.step gives up on a game as lost before it runs out of
+    # moves. Progress is a card going to a block pile or leaving the side
+    # pile, or a face-down card turning up; a productive move is one that
+    # makes progress or exposes a card that can go to a block pile
+    # dead_end: end when no card can ever reach a block pile, leave the
+    # stock or be turned up again (exact, see Game.is_dead_end)
+    # stock_cycles: end after the stock came back to the same state that
+    # many times while dealing was the only legal move, so that the game
+    # can only repeat itself (exact), None for no limit
+    # max_streak: end after that many moves in a row without progress
+    # (revisited states included), None for no limit
+    # counts: games ended by each rule, over every game using the policy
+    # (Game.undo_move takes an ending back)
+
+    def __init__(self, dead_end=True, stock_cycles=1, max_streak=None):
+        self.dead_end = dead_end
+        self.stock_cycles = stock_cycles
+        self.max_streak = max_streak
+        self.counts = {"dead_end": 0, "stock_cycle": 0, "streak": 0}
+
+
+# state encodings, see Game.encode_state
+STATE_LENGTHS = 0 # sorted block and play pile lengths, like current_state
+STATE_FACE_UP = 1 # + face-up cards per play pile
+STATE_FULL = 2 # every face-up card, foundation heights and side pile
+STATE_CANONICAL = 3 # Game.canonical_hash, the whole state up to symmetries
+
+MAX_PILE = NUM_PLAY_PILES - 1 + len(VALUES) # face-down cards + a full run
+FACE_DOWN_CODE = 53 # card codes are stored +1 in the full encoding, 0 is empty
+N_STATE_FEATURES = {
+    STATE_LENGTHS: len(SUITS) + NUM_PLAY_PILES,
+    STATE_FACE_UP: len(SUITS) + 2 * NUM_PLAY_PILES,
+    STATE_FULL: NUM_PLAY_PILES * MAX_PILE + len(SUITS) + 2 + 3,
+}
 
 class Game:
+
+    # phases timed when a profiler is given
+    PROFILED = ["step", "do_move", "get_reward", "game_over", "get_valid_moves", "already_visited",
+                "reorder_piles", "encode_state"]
     
-    def __init__(self):
-        self.deck = Deck(VALUES, SUITS)
+    def __init__(self, compact_cards=False, visited="zobrist", bloom_capacity=100000, bloom_fp_rate=1e-4,
+                 state_level=STATE_LENGTHS, seed=None, deal=None, profiler=None, symmetry=None,
+                 rules=None, move_kernel=False, termination=None):
+        # compact_cards: do rank/color checks on the precomputed Card ints
+        # instead of VALUES.index / SUITS lookups on the string fields
+        # visited: key of the visited-state set, either "zobrist" (set of
+        # 64-bit hashes), "bloom" (bounded BloomFilter of hashes) or "string"
+        # (set of state_to_str, the original behaviour)
+        # state_level: encoding returned by encode_state and step
+        # seed: shuffle the deck with its own random.Random(seed)
+        # deal: 52 card codes giving the deck order to deal from (see deals.py)
+        # symmetry: None, "columns" or "suits", key the visited set (and
+        # STATE_CANONICAL) by canonical_hash instead of state_hash
+        # rules: RuleSet or a name in RULE_SETS, DEFAULT_RULES if None
+        # move_kernel: generate the tableau moves with kernels.legal_moves,
+        # falling back to tableau_moves if the module can't be loaded
+        # termination: TerminationPolicy ending hopeless games early, None
+        # to play until there are no moves left
+        # profiler: profiling.Profiler accumulating the time of each phase
+        # of step, bound here so that games without one pay nothing
+        self.state_level = state_level
+        if symmetry not in (None, "columns", "suits"):
+            raise ValueError("Unknown symmetry: {}".format(symmetry))
+        self.symmetry = symmetry
+        if compact_cards:
+            self.checkCardOrder = self.checkCardOrderCompact
+            self.addToBlock = self.addToBlockCompact
+            self.can_add_to_block = self.can_add_to_block_compact
+            self.check_state = self.check_state_compact
+
+        if rules is None:
+            rules = DEFAULT_RULES
+        elif isinstance(rules, str):
+            rules = RULE_SETS[rules]
+        self.rules = rules
+        # get_valid_moves runs these in order, each appending its moves
+        self.move_generators = [self.tableau_moves]
+        if move_kernel:
+            try:
+                import kernels
+            except ImportError:
+                kernels = None
+            if kernels is not None:
+                self.legal_moves = kernels.legal_moves
+                self.pack_state = kernels.pack_state
+                self.move_generators = [self.kernel_tableau_moves]
+        if rules.foundation_to_tableau:
+            self.move_generators.append(self.foundation_moves)
+        if rules.max_redeals is None:
+            self.deck = Deck(VALUES, SUITS, seed=seed, order=deal, draw_count=rules.draw_count)
+            self.move_generators.append(self.deal_move)
+        else:
+            self.deck = LimitedDeck(VALUES, SUITS, seed=seed, order=deal, draw_count=rules.draw_count,
+                                    max_redeals=rules.max_redeals)
+            self.move_generators.append(self.limited_deal_move)
+        self.can_run_out = rules.max_redeals is not None
+
         self.playPiles = []
         for i in range(NUM_PLAY_PILES):
             thisPile = Pile()
@@ -30,10 +243,52 @@ class Game:
             thisPile.flipFirstCard()  
             self.playPiles.append(thisPile)
         self.blockPiles = {suit: Pile() for suit in SUITS}
+        self.block_set = set(self.blockPiles.values())
         self.deck.cards[0].flip()
         self.cache = {}
-        self.stored_state = None
-        self.visited = set()
+        # undo journal: one list of changes per do_move, see apply_change
+        self.history = []
+        self.redo_history = []
+        self.journal = None
+        # state version: a new number after every change, and back to the
+        # old one on undo, so the move list of a version can be reused
+        self.versions = itertools.count(1)
+        self.version = 0
+        self.version_history = [] # memo() before each history entry
+        self.foundation = 0 # cards on the block piles
+        # move generator caches, see get_valid_moves
+        self.fresh_piles = set() # piles whose pile_targets are up to date
+        self.pile_targets = {} # (pile1, pile2) -> run sizes that can move from pile1 onto pile2
+        self.valid_moves = None
+        self.moves_version = None # version valid_moves was generated at
+        self.valid_ids = None # action ids / mask of the valid_moves list they were built from
+        self.valid_mask = None
+        self.valid_ids_for = None
+        # state encoder caches, see encode_state
+        self.pile_rows = {} # pile -> STATE_FULL row
+        # Zobrist hash of every play/block pile, updated in apply_change
+        self.rehash()
+        if visited == "string":
+            self.visited_key = self.state_to_str
+            self.visited = set()
+        elif visited == "bloom":
+            self.visited_key = self.state_hash if symmetry is None else self.canonical_hash
+            self.visited = BloomFilter(bloom_capacity, bloom_fp_rate)
+        elif visited == "zobrist":
+            self.visited_key = self.state_hash if symmetry is None else self.canonical_hash
+            self.visited = set()
+        else:
+            raise ValueError("Unknown visited mode: {}".format(visited))
+        self.termination = termination
+        self.streak = 0 # moves since the last progress
+        self.stuck_deck = None # deck hash when dealing became the only legal move
+        self.stuck_cycles = 0 # times the deck came back to it since
+        self.ended_by = None # the termination rule that ended the game
+        if termination is not None:
+            self.game_over = self.game_over_or_stuck
+        if profiler is not None:
+            for name in self.PROFILED:
+                setattr(self, name, profiler.wrap(name, getattr(self, name)))
     
     def getGameElements(self):
         returnObject = {
@@ -48,6 +303,11 @@ class Game:
         suitsDifferent = SUITS[higherCard.suit] != SUITS[lowerCard.suit]
         valueConsecutive = VALUES[VALUES.index(higherCard.value)-1] == lowerCard.value
         return suitsDifferent and valueConsecutive
+
+    def checkCardOrderCompact(self,higherCard,lowerCard):
+        return (lowerCard.rank != KING_RANK
+                and higherCard.color != lowerCard.color
+                and higherCard.rank == lowerCard.rank + 1)
     
     def checkIfCompleted(self):
         deckEmpty = len(self.deck.cards)==0
@@ -61,109 +321,197 @@ class Game:
         if card is None:
             return False
         elif len(self.blockPiles[card.suit].cards)>0:
-            highest_value = self.blockPiles[card.suit].cards[0].value
+            highest_value = self.blockPiles[card.suit].cards[-1].value
             if VALUES[VALUES.index(highest_value)+1] == card.value:
-                self.blockPiles[card.suit].cards.insert(0,card)
+                self.blockPiles[card.suit].addCard(card)
                 return True
             else:
                 return False   
         else: 
             if card.value=="A":
-                self.blockPiles[card.suit].cards.insert(0,card)
+                self.blockPiles[card.suit].addCard(card)
                 return True
             else:
                 return False
 
+    def addToBlockCompact(self, card):
+        if self.can_add_to_block_compact(card):
+            self.blockPiles[card.suit].addCard(card)
+            return True
+        return False
+
     def can_add_to_block(self, card):
         if card is None:
             return False
         elif len(self.blockPiles[card.suit].cards)>0:
-            highest_value = self.blockPiles[card.suit].cards[0].value
+            highest_value = self.blockPiles[card.suit].cards[-1].value
             if highest_value == "K": return False
             return VALUES[VALUES.index(highest_value)+1] == card.value  
         else: 
             return card.value=="A"
+
+    def can_add_to_block_compact(self, card):
+        if card is None:
+            return False
+        block = self.blockPiles[card.suit].cards
+        next_rank = block[-1].rank + 1 if len(block) > 0 else 0
+        return card.rank == next_rank
     
+    def flip_tops(self):
+        #Pre: flip up unflipped pile end cards -> do this automatically
+        for pile in self.playPiles:
+            if len(pile.cards)>0 and not pile.cards[-1].flipped:
+                if self.journal is not None:
+                    self.record(("flip", pile, pile.cards[-1]))
+                else:
+                    self.apply_change(("flip", pile, pile.cards[-1]))
+
     def get_valid_moves(self, verbose=False):
+        self.flip_tops()
 
-        #Pre: flip up unflipped pile end cards -> do this automatically
-        [pile.cards[0].flip() for pile in self.playPiles if len(pile.cards)>0 and not pile.cards[0].flipped]
-         
-        # for pile in self.playPiles:
-        #     print(pile)
+        # nothing changed since the last call: reuse the previous list
+        if self.moves_version == self.version:
+            return self.valid_moves[:]
 
         valid_moves = []
+        for generate in self.move_generators:
+            generate(valid_moves)
+
+        self.valid_moves = valid_moves
+        self.moves_version = self.version
+        return valid_moves[:]
+
+    def tableau_moves(self, valid_moves):
 
         #1: check if there are any play pile cards you can play to block piles
         for i, pile in enumerate(self.playPiles):
-            if len(pile.cards) > 0 and self.can_add_to_block(pile.cards[0]):
+            if len(pile.cards) > 0 and self.can_add_to_block(pile.cards[-1]):
                 valid_moves.append((TO_BLOCK, i, -1))
             
         #2: check if cards in deck can be added
-        if self.can_add_to_block(self.deck.getFirstSideCard()):
+        side_card = self.deck.getFirstSideCard()
+        if self.can_add_to_block(side_card):
             valid_moves.append((TO_BLOCK, -1, -1))
             
         #3: move kings to open piles
         for i, pile in enumerate(self.playPiles):
             if len(pile.cards)==0: #pile has no cards
                 for j, pile2 in enumerate(self.playPiles):
-                    if len(pile2.cards)>1 and pile2.cards[0].value == "K":
+                    if len(pile2.cards)>1 and pile2.cards[-1].value == "K":
                         valid_moves.append((TO_PILE, j, i))
                     
-                if self.deck.getFirstSideCard() is not None and self.deck.getFirstSideCard().value == "K":
+                if side_card is not None and side_card.value == "K":
                     valid_moves.append((TO_PILE, -1, i))
             
         #4: add drawn card to playPiles 
-        for i, pile in enumerate(self.playPiles):
-            if len(pile.cards)>0 and self.deck.getFirstSideCard() is not None:
-                if self.checkCardOrder(pile.cards[0], self.deck.getFirstSideCard()):
+        if side_card is not None:
+            for i, pile in enumerate(self.playPiles):
+                if len(pile.cards)>0 and self.checkCardOrder(pile.cards[-1], side_card):
                     valid_moves.append((TO_PILE, -1, i))
                             
-        #5: move around cards in playPiles
+        #5: move around cards in playPiles, only re-checking piles touched since the last call
+        self.update_pile_targets()
         for i, pile1 in enumerate(self.playPiles):
-            pile1_flipped_cards = pile1.getFlippedCards()
-            if len(pile1_flipped_cards)>0: # if we have flipped cards on the pile
-                for j, pile2 in enumerate(self.playPiles):
-                    pile2_flipped_cards = pile2.getFlippedCards()
-                    if i != j and len(pile2_flipped_cards)>0:
-                        
-                        # check whether or not we can move any number of cards
-                        for transfer_cards_size in range(1,len(pile1_flipped_cards)+1):
-                            cards_to_transfer = pile1_flipped_cards[:transfer_cards_size]
-                            if self.checkCardOrder(pile2.cards[0],cards_to_transfer[-1]):
-                                pile1_downcard_count = len(pile1.cards) - len(pile1_flipped_cards)
-                                pile2_downcard_count = len(pile2.cards) - len(pile2_flipped_cards)
-                                valid_moves.append((TO_PILE, i, j, transfer_cards_size))
-                                # if pile2_downcard_count < pile1_downcard_count:
-                                #     [pile2.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                                #     pile1.cards = pile1.cards[transfer_cards_size:]
-                                #     if verbose:
-                                #         print("Moved {0} cards between piles: {1}".format(
-                                #             transfer_cards_size,
-                                #             ", ".join([str(card) for card in cards_to_transfer])
-                                #                                                          ))
-                                # elif pile1_downcard_count==0 and len(cards_to_transfer) == len(pile1.cards):
-                                #     [pile2.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                                #     pile1.cards = []
-                                #     if verbose:
-                                #         print("Moved {0} cards between piles: {1}".format(
-                                #             transfer_cards_size,
-                                #             ", ".join([str(card) for card in cards_to_transfer])
-                                #                                                          ))
-        # add three to the side pile
+            if pile1.face_up_count() == 0: continue
+            for j, pile2 in enumerate(self.playPiles):
+                if i != j:
+                    for transfer_cards_size in self.pile_targets[pile1, pile2]:
+                        valid_moves.append((TO_PILE, i, j, transfer_cards_size))
+
+    def kernel_tableau_moves(self, valid_moves):
+        # tableau_moves, computed from the packed state (see kernels.py)
+        valid_moves.extend(self.legal_moves(*self.pack_state(
+            self.playPiles, [self.blockPiles[suit] for suit in SUITS], self.deck.getFirstSideCard())))
+
+    def foundation_moves(self, valid_moves):
+        # block pile tops back onto the play piles
+        for s, suit in enumerate(SUITS):
+            block = self.blockPiles[suit].cards
+            if len(block) == 0: continue
+            for i, pile in enumerate(self.playPiles):
+                if len(pile.cards) == 0:
+                    if block[-1].value == "K":
+                        valid_moves.append((FROM_BLOCK, s, i))
+                elif self.checkCardOrder(pile.cards[-1], block[-1]):
+                    valid_moves.append((FROM_BLOCK, s, i))
+
+    def deal_move(self, valid_moves):
+        # add draw_count cards to the side pile
         valid_moves.append((DEAL_CARDS, -1, -1))
 
-        return valid_moves    
+    def limited_deal_move(self, valid_moves):
+        if self.deck.can_deal():
+            valid_moves.append((DEAL_CARDS, -1, -1))
+
+    def valid_action_ids(self):
+        # ids of get_valid_moves(), in the same order
+        self.get_valid_moves()
+        if self.valid_ids_for is not self.valid_moves:
+            self.valid_ids = np.fromiter((ACTION_IDS[move] for move in self.valid_moves), dtype=np.int64,
+                                         count=len(self.valid_moves))
+            self.valid_mask = np.zeros(N_ACTIONS, dtype=bool)
+            self.valid_mask[self.valid_ids] = True
+            self.valid_ids_for = self.valid_moves
+        return self.valid_ids
+
+    def action_mask(self):
+        # N_ACTIONS booleans, True for the valid action ids
+        self.valid_action_ids()
+        return self.valid_mask
+
+    def update_pile_targets(self):
+        dirty = [pile for pile in self.playPiles if pile not in self.fresh_piles]
+        if len(dirty) == 0:
+            return
+        self.fresh_piles.update(dirty)
+
+        for pile1 in self.playPiles:
+            run_length = pile1.face_up_count()
+            for pile2 in self.playPiles:
+                if pile2 is pile1 or (pile1 not in dirty and pile2 not in dirty):
+                    continue
+                
+                # check whether or not we can move any number of cards
+                sizes = []
+                if run_length>0 and pile2.face_up_count()>0:
+                    for transfer_cards_size in range(1,run_length+1):
+                        if self.checkCardOrder(pile2.cards[-1],pile1.cards[-transfer_cards_size]):
+                            sizes.append(transfer_cards_size)
+                self.pile_targets[pile1, pile2] = sizes
+
+    def touch_pile(self, pile):
+        # must be called whenever a play pile's cards change
+        self.fresh_piles.discard(pile)
+        self.pile_rows.pop(pile, None)
+
+    def invalidate_moves(self):
+        self.fresh_piles = set()
+        self.pile_targets = {}
+        self.pile_rows = {}
+        self.version = next(self.versions)
 
     def takeTurn(self, verbose=False):
+        # takeGreedyTurn edits the piles directly: reset the caches and hashes
+        # afterwards and drop the undo history
+        moved = self.takeGreedyTurn(verbose)
+        self.invalidate_moves()
+        self.rehash()
+        self.foundation = sum(len(pile.cards) for pile in self.blockPiles.values())
+        self.history = []
+        self.redo_history = []
+        self.version_history = []
+        self.journal = None
+        return moved
+
+    def takeGreedyTurn(self, verbose=False):
                 
         #Pre: flip up unflipped pile end cards -> do this automatically
-        [pile.cards[0].flip() for pile in self.playPiles if len(pile.cards)>0 and not pile.cards[0].flipped]
+        [pile.flipFirstCard() for pile in self.playPiles if len(pile.cards)>0 and not pile.cards[-1].flipped]
          
         #1: check if there are any play pile cards you can play to block piles
         for pile in self.playPiles:
-            if len(pile.cards) > 0 and self.addToBlock(pile.cards[0]):
-                card_added = pile.cards.pop(0)
+            if len(pile.cards) > 0 and self.addToBlock(pile.cards[-1]):
+                card_added = pile.takeCard()
                 if verbose:
                     print("Adding play pile card to block: {0}".format(str(card_added)))
                 return True
@@ -179,8 +527,8 @@ class Game:
         for pile in self.playPiles:
             if len(pile.cards)==0: #pile has no cards
                 for pile2 in self.playPiles:
-                    if len(pile2.cards)>1 and pile2.cards[0].value == "K":
-                        card_added = pile2.cards.pop(0)
+                    if len(pile2.cards)>1 and pile2.cards[-1].value == "K":
+                        card_added = pile2.takeCard()
                         pile.addCard(card_added)
                         if verbose:
                             print("Moving {0} from Pile to Empty Pile".format(str(card_added)))
@@ -196,7 +544,7 @@ class Game:
         #4: add drawn card to playPiles 
         for pile in self.playPiles:
             if len(pile.cards)>0 and self.deck.getFirstCard() is not None:
-                if self.checkCardOrder(pile.cards[0],self.deck.getFirstCard()):
+                if self.checkCardOrder(pile.cards[-1],self.deck.getFirstCard()):
                     card_added = self.deck.takeFirstCard()
                     pile.addCard(card_added) 
                     if verbose:
@@ -205,28 +553,18 @@ class Game:
                             
         #5: move around cards in playPiles
         for pile1 in self.playPiles:
-            pile1_flipped_cards = pile1.getFlippedCards()
+            pile1_flipped_cards = pile1.face_up_run()
             if len(pile1_flipped_cards)>0:
                 for pile2 in self.playPiles:
-                    pile2_flipped_cards = pile2.getFlippedCards()
-                    if pile2 is not pile1 and len(pile2_flipped_cards)>0:
+                    if pile2 is not pile1 and pile2.face_up_count()>0:
                         for transfer_cards_size in range(1,len(pile1_flipped_cards)+1):
-                            cards_to_transfer = pile1_flipped_cards[:transfer_cards_size]
-                            if self.checkCardOrder(pile2.cards[0],cards_to_transfer[-1]):
-                                pile1_downcard_count = len(pile1.cards) - len(pile1_flipped_cards)
-                                pile2_downcard_count = len(pile2.cards) - len(pile2_flipped_cards)
-                                if pile2_downcard_count < pile1_downcard_count:
-                                    [pile2.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                                    pile1.cards = pile1.cards[transfer_cards_size:]
-                                    if verbose:
-                                        print("Moved {0} cards between piles: {1}".format(
-                                            transfer_cards_size,
-                                            ", ".join([str(card) for card in cards_to_transfer])
-                                                                                         ))
-                                    return True
-                                elif pile1_downcard_count==0 and len(cards_to_transfer) == len(pile1.cards):
-                                    [pile2.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                                    pile1.cards = []
+                            if self.checkCardOrder(pile2.cards[-1],pile1_flipped_cards[-transfer_cards_size]):
+                                pile1_downcard_count = pile1.face_down_count()
+                                pile2_downcard_count = pile2.face_down_count()
+                                if pile2_downcard_count < pile1_downcard_count or (
+                                        pile1_downcard_count==0 and transfer_cards_size == len(pile1.cards)):
+                                    cards_to_transfer = pile1.takeCards(transfer_cards_size)
+                                    pile2.addCards(cards_to_transfer)
                                     if verbose:
                                         print("Moved {0} cards between piles: {1}".format(
                                             transfer_cards_size,
@@ -238,26 +576,19 @@ class Game:
         return False
      
     def do_move(self, move):
+        # every change goes through record() so undo_move can roll it back
+        self.journal = []
+        self.history.append(self.journal)
+        self.version_history.append(self.memo())
+        self.redo_history = []
+
         if len(move) == 4: # move a bunch of cards from pile a to b
             _, pile_origin_i, pile_dest_i, transfer_cards_size = move
             pile_origin = self.playPiles[pile_origin_i]
             pile_dest = self.playPiles[pile_dest_i]
-            pile_dest_flipped_cards = pile_dest.getFlippedCards()
-            pile_origin_flipped_cards = pile_origin.getFlippedCards()
-
-            pile_dest_downcard_count = len(pile_dest.cards) - len(pile_dest_flipped_cards)
-            pile_origin_downcard_count = len(pile_origin.cards) - len(pile_origin_flipped_cards)
-            
-            cards_to_transfer = pile_origin_flipped_cards[:transfer_cards_size]
-            # print("Transfering cards {}".format([str(c) for c in cards_to_transfer]))
+            transfer_cards_size = min(transfer_cards_size, pile_origin.face_up_count())
 
-            if len(cards_to_transfer) < len(pile_origin.cards):
-                [pile_dest.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                pile_origin.cards = pile_origin.cards[transfer_cards_size:] 
-                
-            elif len(cards_to_transfer) == len(pile_origin.cards):
-                [pile_dest.cards.insert(0,card) for card in reversed(cards_to_transfer)]
-                pile_origin.cards = []
+            self.record(("move", pile_origin, pile_dest, transfer_cards_size))
             return True
 
         elif len(move) == 3:
@@ -265,14 +596,15 @@ class Game:
 
             if action == TO_BLOCK:
                 if origin == -1: # deck
-                    if self.addToBlock(self.deck.getFirstSideCard()):
-                        self.deck.takeFirstSideCard()
+                    card = self.deck.getFirstSideCard()
+                    if self.can_add_to_block(card):
+                        self.record(("side", self.blockPiles[card.suit]))
                         return True
                 else: # play pile i
                     pile = self.playPiles[origin]
                     # print(pile)
-                    if len(pile.cards) > 0 and self.addToBlock(pile.cards[0]):
-                        card_added = pile.cards.pop(0)
+                    if len(pile.cards) > 0 and self.can_add_to_block(pile.cards[-1]):
+                        self.record(("move", pile, self.blockPiles[pile.cards[-1].suit], 1))
                         return True
                 return False
 
@@ -281,32 +613,95 @@ class Game:
                 action, origin, dest = move
 
                 if origin == -1: # deck
-                    card_added = self.deck.takeFirstSideCard()
-                    self.playPiles[dest].addCard(card_added)
+                    if self.deck.getFirstSideCard() is None:
+                        return False
+                    self.record(("side", self.playPiles[dest]))
                     return True 
                 else: # play pile i
-                    pile_dest = self.playPiles[dest]
-                    pile_origin = self.playPiles[origin]
-                    # print("Origin ", str(pile_origin))
-                    # print("Dest ", str(pile_dest))
-                    pile_dest.addCard(pile_origin.cards[0])
-                    card_added = pile_origin.cards.pop(0)
+                    self.record(("move", self.playPiles[origin], self.playPiles[dest], 1))
                     return True
 
+            if action == FROM_BLOCK:
+                block = self.blockPiles[list(SUITS)[origin]]
+                if len(block.cards) == 0:
+                    return False
+                self.record(("move", block, self.playPiles[move[2]], 1))
+                return True
+
             if action == DEAL_CARDS:
-                self.deck.drawCardsToSide()
+                if not self.deck.can_deal():
+                    return False
+                recycled, drawn = self.deck.drawCardsToSide()
+                self.journal.append(("deal", recycled, drawn))
+                self.version = next(self.versions)
                 return True
 
         return False
 
+    def record(self, change):
+        self.journal.append(change)
+        self.apply_change(change)
+
+    def apply_change(self, change, forward=True):
+        kind = change[0]
+        self.version = next(self.versions)
+
+        if kind == "move": # n cards from the top of a pile to the top of another
+            _, pile_origin, pile_dest, n = change
+            if not forward:
+                pile_origin, pile_dest = pile_dest, pile_origin
+            cards = pile_origin.takeCards(n)
+            self.pile_hashes[pile_origin] ^= zobrist.cards_hash(cards, len(pile_origin.cards))
+            self.pile_hashes[pile_dest] ^= zobrist.cards_hash(cards, len(pile_dest.cards))
+            pile_dest.addCards(cards)
+            if pile_dest in self.block_set:
+                self.foundation += n
+            elif pile_origin in self.block_set:
+                self.foundation -= n
+            self.touch_pile(pile_origin)
+            self.touch_pile(pile_dest)
+
+        elif kind == "side": # top side pile card to a pile
+            _, pile_dest = change
+            if forward:
+                card = self.deck.takeFirstSideCard()
+                self.pile_hashes[pile_dest] ^= zobrist.card_key(card, len(pile_dest.cards))
+                pile_dest.addCard(card)
+            else:
+                card = pile_dest.takeCard()
+                self.pile_hashes[pile_dest] ^= zobrist.card_key(card, len(pile_dest.cards))
+                self.deck.putBackSideCard(card)
+            if pile_dest in self.block_set:
+                self.foundation += 1 if forward else -1
+            self.touch_pile(pile_dest)
+
+        elif kind == "flip":
+            _, pile, card = change
+            depth = len(pile.cards) - 1
+            self.pile_hashes[pile] ^= zobrist.card_key(card, depth)
+            pile.flipFirstCard() # card is the top card
+            self.pile_hashes[pile] ^= zobrist.card_key(card, depth)
+            self.touch_pile(pile)
+
+        elif kind == "deal":
+            _, recycled, drawn = change
+            if forward:
+                self.deck.drawCardsToSide()
+            else:
+                self.deck.undoDrawCardsToSide(recycled, drawn)
+
+        elif kind == "order":
+            _, old_order, new_order = change
+            self.playPiles = new_order if forward else old_order
+
     def check_state(self):
 
         correct = True
 
         for suit, pile in self.blockPiles.items():
             if len(pile.cards) == 0: continue
-            prev_card = pile.cards[0]
-            for card in pile.cards[1:]:
+            prev_card = pile.cards[-1]
+            for card in pile.cards[-2::-1]:
                 if VALUES.index(prev_card.value) != (VALUES.index(card.value) + 1):
                     print("Pile {}: {}".format(suit, pile))
                     correct = False
@@ -314,8 +709,8 @@ class Game:
 
         for i, pile in enumerate(self.playPiles):
             if len(pile.cards) == 0: continue
-            prev_card = pile.cards[0]
-            for card in pile.cards[1:]:
+            prev_card = pile.cards[-1]
+            for card in pile.cards[-2::-1]:
                 if not card.flipped: break
                 if VALUES.index(prev_card.value) != (VALUES.index(card.value) - 1):
                     print("Pile {}: {}".format(i, pile)) 
@@ -324,8 +719,66 @@ class Game:
 
         return correct
 
+    def check_state_compact(self):
+
+        correct = True
+
+        for suit, pile in self.blockPiles.items():
+            for card, prev_card in zip(pile.cards, pile.cards[1:]):
+                if prev_card.rank != card.rank + 1:
+                    print("Pile {}: {}".format(suit, pile))
+                    correct = False
+
+        for i, pile in enumerate(self.playPiles):
+            top_down = pile.cards[::-1]
+            for prev_card, card in zip(top_down, top_down[1:]):
+                if not card.flipped: break
+                if prev_card.rank != card.rank - 1:
+                    print("Pile {}: {}".format(i, pile))
+                    correct = False
+
+        return correct
+
     def undo_move(self):
-        self.deck, self.playPiles, self.blockPiles = self.stored_state
+        if len(self.history) == 0:
+            return False
+        after = self.memo()
+        changes = self.history.pop()
+        for change in reversed(changes):
+            self.apply_change(change, forward=False)
+        # same state as before the move: its version, its move list if it
+        # had been generated, and the termination counters
+        self.restore_memo(self.version_history.pop())
+        self.redo_history.append((changes, after))
+        self.journal = self.history[-1] if len(self.history) > 0 else None
+        return True
+
+    def redo_move(self):
+        if len(self.redo_history) == 0:
+            return False
+        changes, after = self.redo_history.pop()
+        self.version_history.append(self.memo())
+        for change in changes:
+            self.apply_change(change)
+        self.restore_memo(after)
+        self.history.append(changes)
+        self.journal = changes
+        return True
+
+    def memo(self):
+        # what undo_move and redo_move put back besides the piles
+        return (self.version, self.valid_moves, self.moves_version,
+                self.streak, self.stuck_deck, self.stuck_cycles, self.ended_by)
+
+    def restore_memo(self, memo):
+        if memo[-1] != self.ended_by:
+            # undoing or redoing the move a termination rule ended the game on
+            if self.ended_by is not None:
+                self.termination.counts[self.ended_by] -= 1
+            if memo[-1] is not None:
+                self.termination.counts[memo[-1]] += 1
+        (self.version, self.valid_moves, self.moves_version,
+         self.streak, self.stuck_deck, self.stuck_cycles, self.ended_by) = memo
 
     def state_to_str(self):
         state = ""
@@ -343,11 +796,63 @@ class Game:
 
         return state
 
+    def rehash(self):
+        self.pile_hashes = {
+            pile: zobrist.pile_hash(pile.cards)
+            for pile in self.playPiles + list(self.blockPiles.values())
+        }
+
+    def state_hash(self):
+        # 64-bit Zobrist hash of what state_to_str shows (face-down cards
+        # only by position). It is finer than the string: state_to_str runs
+        # the piles together, so distinct states can share a string, but
+        # two distinct strings never share a hash (up to 64-bit collisions)
+        h = self.deck.zobrist()
+        for i, pile in enumerate(self.playPiles):
+            h ^= zobrist.slot_hash(self.pile_hashes[pile], i)
+        for i, suit in enumerate(SUITS):
+            h ^= zobrist.slot_hash(self.pile_hashes[self.blockPiles[suit]], NUM_PLAY_PILES + i)
+        return h
+
+    def canonical_hash(self, exact=False):
+        # state_hash up to the order of the play piles, and with symmetry
+        # "suits" up to swapping suits of the same color (the smallest hash
+        # of the 4 relabelings, recomputed from the cards: ~4x slower).
+        # exact: tell apart piles whose face-down cards come from different
+        # columns of the deal, for searches that know the hidden cards
+        # (only the column symmetry is used then)
+        h = self.deck.zobrist()
+        piles = 0
+        for pile in self.playPiles:
+            pile_h = self.pile_hashes[pile]
+            if exact and pile.down > 0:
+                pile_h ^= zobrist.COLUMN[pile.cards[0].code]
+            piles += zobrist.mix(pile_h)
+        h ^= piles & zobrist.MASK
+        for i, suit in enumerate(SUITS):
+            h ^= zobrist.slot_hash(self.pile_hashes[self.blockPiles[suit]], NUM_PLAY_PILES + i)
+        if self.symmetry == "suits" and not exact:
+            h = min([h] + [self.relabeled_hash(relabel) for relabel in zobrist.SUIT_SWAPS[1:]])
+        return h
+
+    def relabeled_hash(self, relabel):
+        # canonical_hash of the game with its suits relabeled (zobrist.SUIT_SWAPS)
+        h = (zobrist.deck_hash(self.deck.cards, relabel) ^ zobrist.side_hash(self.deck.side_pile, relabel)
+             ^ self.deck.pass_hash())
+        piles = 0
+        for pile in self.playPiles:
+            piles += zobrist.mix(zobrist.pile_hash(pile.cards, relabel))
+        h ^= piles & zobrist.MASK
+        for i, suit in enumerate(SUITS):
+            slot = relabel[13 * i] // 13 # where suit i goes
+            h ^= zobrist.slot_hash(zobrist.pile_hash(self.blockPiles[suit].cards, relabel), NUM_PLAY_PILES + slot)
+        return h
+
     def already_visited(self):
-        str_state = self.state_to_str()
+        key = self.visited_key()
 
-        if str_state not in self.visited:
-            self.visited.add(str_state)
+        if key not in self.visited:
+            self.visited.add(key)
             return False
         return True
 
@@ -362,7 +867,7 @@ class Game:
 
         # play piles flipped
         lengths = [len(p.cards) for p in self.playPiles]
-        flipped_lengths = [len(p.getFlippedCards()) for p in self.playPiles]
+        flipped_lengths = [p.face_up_count() for p in self.playPiles]
         sorted_flip = [
             f for _, f in sorted(zip(lengths, flipped_lengths))
         ]
@@ -373,62 +878,200 @@ class Game:
         return "/".join([
             block_pile_lengths, play_pile_lengths #, play_pile_flipped_lengths
             ])
+
+    def pile_row(self, pile):
+        row = self.pile_rows.get(pile)
+        if row is None:
+            row = self.pile_rows[pile] = np.zeros(MAX_PILE, dtype=np.uint8)
+            for i, card in enumerate(pile.cards): # bottom to top
+                row[i] = card.code + 1 if card.flipped else FACE_DOWN_CODE
+        return row
+
+    def encode_state(self, level=None):
+        # key of the state. STATE_LENGTHS and STATE_FACE_UP pack the sorted
+        # 4-5 bit pile counts into an int, re-sorted on every call.
+        # STATE_FULL returns the bytes of state_features, whose pile rows
+        # are only rebuilt for the piles a move touched (see touch_pile)
+        if level is None:
+            level = self.state_level
+        if level == STATE_FULL:
+            return self.state_features(STATE_FULL).tobytes()
+        if level == STATE_CANONICAL:
+            return self.canonical_hash()
+
+        key = 0
+        for l in sorted([len(self.blockPiles[s].cards) for s in SUITS]):
+            key = (key << 4) | l
+        if level == STATE_LENGTHS:
+            for l in sorted([len(p.cards) for p in self.playPiles]):
+                key = (key << 5) | l
+        else:
+            for l, f in sorted([(len(p.cards), p.face_up_count()) for p in self.playPiles]):
+                key = (key << 9) | (l << 4) | f
+        return key
+
+    def state_features(self, level=None):
+        # fixed-size uint8 vector of the state, N_STATE_FEATURES[level] long
+        if level is None:
+            level = self.state_level
+        blocks = [len(self.blockPiles[s].cards) for s in SUITS]
+
+        if level == STATE_LENGTHS:
+            return np.array(sorted(blocks) + sorted([len(p.cards) for p in self.playPiles]), dtype=np.uint8)
+
+        if level == STATE_FACE_UP:
+            pairs = sorted([(len(p.cards), p.face_up_count()) for p in self.playPiles])
+            return np.array(sorted(blocks) + [l for l, _ in pairs] + [f for _, f in pairs], dtype=np.uint8)
+
+        side = [card.code + 1 for card in self.deck.side_pile]
+        extra = blocks + [len(self.deck.cards), len(self.deck.side_pile)] + side + [0] * (3 - len(side))
+        return np.concatenate([self.pile_row(p) for p in self.playPiles] + [np.array(extra, dtype=np.uint8)])
     
     def game_over(self):
         # win game
-        if sum([len(b.cards) for _, b in self.blockPiles.items()]) == 52:
+        if self.foundation == 52:
             return True, True
 
-        # lose game
-        if len(self.get_valid_moves()) == 0:
+        # lose game: only possible once the stock can run out, there is
+        # always a deal otherwise
+        if self.can_run_out and len(self.get_valid_moves()) == 0:
             return True, False
 
         # game still on
         return False, False
 
-    def get_reward(self, move):
-        if move[0] == TO_BLOCK:
-            return 6 # move card to block pile: very good!
+    def game_over_or_stuck(self):
+        # game_over, also ending the game as lost when self.termination
+        # says it's stuck; called once per step, after the move
+        game_over, win = Game.game_over(self)
+        if game_over:
+            return game_over, win
+        self.get_valid_moves()
 
-        if move[0] == TO_PILE:
-            if len(move) != 4:
-                return 2 # move card from deck to play pile
-            else:
-                return move[3] # move cards between play piles
+        policy = self.termination
+        progress = False
+        dealt = False
+        for change in self.journal or ():
+            if change[0] == "side" or change[0] == "flip":
+                progress = True
+            elif change[0] == "move" and change[2] in self.block_set:
+                progress = True
+            elif change[0] == "deal":
+                dealt = True
+        if progress:
+            self.streak = 0
+        else:
+            self.streak += 1
 
-        if move[0] == DEAL_CARDS:
-            return 0 # deal cards: neutral
+        # a dead end has no productive move either
+        if (policy.dead_end and not progress
+                and not any(self.is_productive(move) for move in self.valid_moves)
+                and self.is_dead_end()):
+            return self.give_up("dead_end")
 
-        return 0
+        if len(self.valid_moves) == 1 and self.valid_moves[0][0] == DEAL_CARDS:
+            if self.stuck_deck is None:
+                self.stuck_deck = self.deck.zobrist()
+                self.stuck_cycles = 0
+            elif dealt and self.deck.zobrist() == self.stuck_deck:
+                # only deals since, so the tableau is unchanged too: the
+                # game is back in the same state and can only loop
+                self.stuck_cycles += 1
+                if policy.stock_cycles is not None and self.stuck_cycles >= policy.stock_cycles:
+                    return self.give_up("stock_cycle")
+        else:
+            self.stuck_deck = None
+        if policy.max_streak is not None and self.streak >= policy.max_streak:
+            return self.give_up("streak")
+        return False, False
 
-    def step(self, move):
+    def give_up(self, rule):
+        self.termination.counts[rule] += 1
+        self.ended_by = rule
+        return True, False
 
-        self.stored_state = [
-            self.deck.copy(deep=True),
-            self.playPiles.copy(),
-            self.blockPiles.copy()
-        ]
+    def is_productive(self, move):
+        if move[0] == TO_BLOCK or move[1] == -1:
+            return move[0] != DEAL_CARDS
+        if move[0] != TO_PILE:
+            return False
+        pile = self.playPiles[move[1]]
+        n = move[3] if len(move) == 4 else 1
+        if n == pile.face_up_count():
+            return pile.face_down_count() > 0 # uncovers a card
+        return self.can_add_to_block(pile.cards[-n - 1])
+
+    def is_dead_end(self):
+        # no card can ever go to a block pile, leave the stock or turn face
+        # up again, whatever is moved around the tableau. Any face-up card
+        # is taken as a possible pile top, and any pile without face-down
+        # cards as one that could be emptied for a king, so this never gives
+        # up on a live game
+        if self.rules.foundation_to_tableau:
+            return False
+        face_up = [card.code for pile in self.playPiles for card in pile.cards[pile.down:]]
+        stock = [card.code for card in self.deck.cards] + [card.code for card in self.deck.side_pile]
+        next_cards = {s * len(VALUES) + len(self.blockPiles[suit].cards) for s, suit in enumerate(SUITS)
+                      if len(self.blockPiles[suit].cards) < len(VALUES)}
+        if not next_cards.isdisjoint(face_up) or not next_cards.isdisjoint(stock):
+            return False
+
+        fits = set() # cards that could go on a face-up card
+        for code in face_up:
+            fits.update(STACKS_ON[code])
+        can_empty = any(pile.down == 0 for pile in self.playPiles)
+        for code in stock:
+            if code in fits or (can_empty and code % len(VALUES) == KING_RANK):
+                return False
+        for pile in self.playPiles:
+            if pile.down == 0:
+                continue
+            if pile.down == len(pile.cards):
+                return False # top card still to be turned up
+            bottom = pile.cards[pile.down].code # face-up card resting on the face-down ones
+            if bottom in fits or (can_empty and bottom % len(VALUES) == KING_RANK):
+                return False
+        return True
+
+    def get_reward(self, move):
+        reward = self.rules.move_rewards.get(move)
+        if reward is None: # not an action id
+            return self.rules.reward(move)
+        return reward
+
+    def step(self, move):
 
         move_made = self.do_move(move)
         reward = self.get_reward(move)
-        game_over, win = self.game_over()
+        self.flip_tops()
         visited = False
 
+        if self.already_visited():
+            reward += self.rules.rewards["visited"]
+            visited = True
+
+        self.reorder_piles()
+
+        # after the reorder, so the moves it generates (if any) are the
+        # ones the next get_valid_moves call returns
+        game_over, win = self.game_over()
         if game_over and win:
-            reward += 100
+            reward += self.rules.rewards["win"]
         elif game_over and not win:
-            reward -= 100
+            reward += self.rules.rewards["lose"]
 
-        if self.already_visited():
-            reward -= 100
-            visited = True
+        return self.encode_state(), reward, move_made, game_over, win, visited
 
+    def reorder_piles(self):
         # reorder the playPiles in order of size
         def get_length(pile):
             return len(pile.cards)
-        self.playPiles = sorted(self.playPiles, key=get_length)
+        sorted_piles = sorted(self.playPiles, key=get_length)
+        if sorted_piles != self.playPiles:
+            self.record(("order", self.playPiles, sorted_piles))
 
-        return self.current_state(), reward, move_made, game_over, win, visited
+    def step_id(self, action):
+        return self.step(ACTION_MOVES[action])
 
     def simulate(self, draw = False, verbose=False):
         while True:
@@ -460,9 +1103,6 @@ class Game:
 
             if not move_done: return
 
-        # for move in valid_moves:
-        #     if not self.do_move(move): continue
-        #     self.simulate()
-        #     self.undo_move()
+        # exhaustive search over do_move / undo_move: see solver.solve
         
     
\ No newline at end of file
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import sys
+import time
+
+from solitaire import Game, SUITS, VALUES, TO_BLOCK, TO_PILE, DEAL_CARDS, FROM_BLOCK
+
+# Exact solver: depth-first search over Game.do_move / Game.undo_move with
+# a transposition table of state hashes, so every reachable position is
+# expanded at most once. Children are tried best first (foundation moves,
+# then moves that uncover face-down cards, ...). Two prunings keep the
+# tree small without losing solutions:
+#   - a tableau card that no other card will ever need to sit on (both
+#     opposite color foundations are high enough) is played to its
+#     foundation straight away, as the only child,
+#   - a king can go to any empty pile, only the first one is tried.
+# The search knows the face-down cards, so the answer is about the deal,
+# not about what a player could infer.
+
+SOLVABLE = "solvable"
+UNSOLVABLE = "unsolvable"
+UNKNOWN = "unknown"
+
+N_CARDS = len(VALUES) * len(SUITS)
+
+
+class SolveResult:
+
+    def __init__(self, status, nodes, seconds, solution=None, foundation=0):
+        self.status = status
+        self.nodes = nodes
+        self.seconds = seconds
+        self.solution = solution # moves from the starting position, if solvable
+        self.foundation = foundation # most cards on the block piles in any position searched
+
+    @property
+    def nodes_per_sec(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return "SolveResult({}, nodes={}, {:.2f}s, {:.0f} nodes/s)".format(
+            self.status, self.nodes, self.seconds, self.nodes_per_sec)
+
+
+def foundation_count(game):
+    return game.foundation
+
+def is_won(game):
+    return foundation_count(game) == N_CARDS
+
+def state_key(game):
+    # play piles in any order are the same position; the solver knows the
+    # face-down cards, so only piles hiding the same cards are swapped
+    return game.canonical_hash(exact=True)
+
+def is_safe_to_block(game, card):
+    # nothing will ever have to be stacked on card: the opposite color
+    # cards one rank lower are already on their foundations
+    if card.rank <= 1:
+        return True
+    heights = [len(game.blockPiles[suit].cards) for suit in SUITS if SUITS[suit] != SUITS[card.suit]]
+    return min(heights) >= card.rank
+
+def ordered_moves(game):
+    moves = game.get_valid_moves()
+
+    for move in moves:
+        if move[0] == TO_BLOCK and move[1] != -1:
+            if is_safe_to_block(game, game.playPiles[move[1]].cards[-1]):
+                return [move]
+
+    first_empty = next((i for i, pile in enumerate(game.playPiles) if len(pile.cards) == 0), None)
+    scored = []
+    for move in moves:
+        action, origin, dest = move[:3]
+        if action == TO_PILE and len(move) == 3 and len(game.playPiles[dest].cards) == 0:
+            if dest != first_empty:
+                continue # same position up to the order of the piles
+        scored.append((move_priority(game, move), len(scored), move))
+
+    # the stack pops from the end: best moves go last
+    scored.sort(reverse=True)
+    return [move for _, _, move in scored]
+
+def move_priority(game, move):
+    action, origin = move[0], move[1]
+    if action == TO_BLOCK:
+        return 0
+    if action == DEAL_CARDS:
+        return 4
+    if action == FROM_BLOCK:
+        return 5
+    if origin == -1:
+        return 2
+    pile = game.playPiles[origin]
+    n = move[3] if len(move) == 4 else 1
+    if n == pile.face_up_count() and pile.face_down_count() > 0:
+        return 1 # uncovers a face-down card
+    return 3
+
+
+def solve(game, max_nodes=1000000, max_seconds=None):
+    start = time.perf_counter()
+    nodes = 0
+    game.get_valid_moves()
+    best = foundation_count(game)
+    if best == N_CARDS:
+        return SolveResult(SOLVABLE, 0, 0.0, [], best)
+
+    seen = {state_key(game)}
+    path = []
+    stack = [ordered_moves(game)]
+
+    while stack:
+        if nodes >= max_nodes or (max_seconds is not None and nodes % 256 == 0
+                                  and time.perf_counter() - start > max_seconds):
+            result = SolveResult(UNKNOWN, nodes, time.perf_counter() - start, foundation=best)
+            break
+
+        moves = stack[-1]
+        if len(moves) == 0:
+            stack.pop()
+            if path:
+                path.pop()
+                game.undo_move()
+            continue
+
+        move = moves.pop()
+        game.do_move(move)
+        game.get_valid_moves() # flips up the uncovered cards
+        nodes += 1
+
+        key = state_key(game)
+        if key in seen:
+            game.undo_move()
+            continue
+        seen.add(key)
+
+        path.append(move)
+        on_block = foundation_count(game)
+        best = max(best, on_block)
+        if on_block == N_CARDS:
+            result = SolveResult(SOLVABLE, nodes, time.perf_counter() - start, path[:], best)
+            break
+        stack.append(ordered_moves(game))
+    else:
+        result = SolveResult(UNSOLVABLE, nodes, time.perf_counter() - start, foundation=best)
+
+    # leave the game as we found it
+    for _ in range(len(path)):
+        game.undo_move()
+    return result
+
+
+def parse_range(text):
+    # "0-99" or "5"
+    if "-" in text:
+        first, last = text.split("-")
+        return range(int(first), int(last) + 1)
+    return range(int(text), int(text) + 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label deals as solvable / unsolvable / unknown")
+    parser.add_argument("--seeds", default="0-9", help="seed range, e.g. 0-99 (Game(seed=...))")
+    parser.add_argument("--deals", default=None, help="deal corpus (deals.py), overrides --seeds")
+    parser.add_argument("--max-nodes", type=int, default=1000000)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--output", default=None, help="write one CSV row per deal")
+    args = parser.parse_args()
+
+    if args.deals is not None:
+        from deals import load_corpus
+        corpus = load_corpus(args.deals)
+        games = ((i, lambda i=i: Game(deal=corpus[i])) for i in range(len(corpus)))
+    else:
+        games = ((seed, lambda seed=seed: Game(seed=seed)) for seed in parse_range(args.seeds))
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(["deal", "status", "nodes", "seconds", "nodes_per_sec", "solution_length"])
+    counts = {SOLVABLE: 0, UNSOLVABLE: 0, UNKNOWN: 0}
+    total_nodes, total_seconds = 0, 0.0
+    for deal, make_game in games:
+        result = solve(make_game(), args.max_nodes, args.max_seconds)
+        counts[result.status] += 1
+        total_nodes += result.nodes
+        total_seconds += result.seconds
+        writer.writerow([deal, result.status, result.nodes, "{:.3f}".format(result.seconds),
+                         "{:.0f}".format(result.nodes_per_sec),
+                         len(result.solution) if result.solution is not None else ""])
+        out.flush()
+
+    print("{} solvable, {} unsolvable, {} unknown, {:.0f} nodes/s".format(
+        counts[SOLVABLE], counts[UNSOLVABLE], counts[UNKNOWN],
+        total_nodes / total_seconds if total_seconds > 0 else 0), file=sys.stderr)
@@ -0,0 +1,67 @@
+import importlib
+import random
+
+import numpy as np
+
+import batch_game
+from batch_game import BatchGame, MAX_PILE
+from solitaire import Game, ACTION_IDS, ACTION_MOVES
+
+# BatchGame must follow the rules of Game: each row of the batch is loaded
+# from a Game, both are stepped with the same random moves, and the masks,
+# rewards and resulting positions are compared game by game.
+
+STATE_ARRAYS = ["tableau", "pile_len", "down", "foundation", "deck", "deck_len", "side_len"]
+
+
+def live_state(batch, i, name):
+    # the part of a state array that means something: tableau slots above
+    # a pile's length and deck slots past deck_len are left over
+    array = getattr(batch, name)[i]
+    if name == "tableau":
+        return array * (np.arange(MAX_PILE)[None, :] < batch.pile_len[i][:, None])
+    if name == "deck":
+        return array[:batch.deck_len[i]]
+    return array
+
+
+def test_import_leaves_global_random_alone():
+    random.seed(5)
+    expected = random.random()
+    random.seed(5)
+    importlib.reload(batch_game)
+    assert random.random() == expected
+
+
+def test_batch_matches_game():
+    n = 32
+    games = [Game(seed=seed) for seed in range(n)]
+    batch = BatchGame(n, seed=0)
+    for i, game in enumerate(games):
+        batch.load_game(i, game)
+    reference = BatchGame(n, seed=1)
+    rng = random.Random(0)
+
+    for _ in range(300):
+        mask = batch.valid_move_mask()
+        actions = []
+        for i, game in enumerate(games):
+            moves = game.get_valid_moves()
+            assert sorted(ACTION_IDS[move] for move in moves) == list(np.flatnonzero(mask[i]))
+            actions.append(ACTION_IDS[moves[rng.randrange(len(moves))]])
+
+        rewards, dones, wins = batch.step(actions)
+        for i, game in enumerate(games):
+            _, reward, _, _, win, visited = game.step(ACTION_MOVES[actions[i]])
+            # BatchGame has no visited-state penalty
+            if visited:
+                reward -= game.rules.rewards["visited"]
+            assert rewards[i] == reward
+            assert wins[i] == win
+            if dones[i]:
+                games[i] = Game(seed=n + i)
+                batch.load_game(i, games[i])
+                continue
+            reference.load_game(i, game)
+            for name in STATE_ARRAYS:
+                assert np.array_equal(live_state(batch, i, name), live_state(reference, i, name)), name
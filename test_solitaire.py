@@ -0,0 +1,214 @@
+import hashlib
+import random
+import sys
+
+import pytest
+
+from solitaire import Game, TerminationPolicy, SUITS, TO_BLOCK, TO_PILE, DEAL_CARDS, FROM_BLOCK
+
+# Game.get_valid_moves keeps its results between calls and only rechecks
+# the piles a move touched. These tests play random games, with undo, redo
+# and takeTurn mixed in, and compare every move list with one generated
+# from scratch the way the original get_valid_moves did. A digest of
+# seeded games pins the rules themselves to the behaviour recorded before
+# Pile and Deck were turned into top-at-end stacks.
+
+# rules_trace of Game(seed=...) games, recorded on the list-front piles
+RULES_TRACE_DIGEST = "f74d8915edd12f594945accce9d9b84c19dfbd1ab6558ff26c4cb6bd4f3c1794"
+
+CONFIGS = [
+    {},
+    {"compact_cards": True},
+    {"move_kernel": True},
+    {"compact_cards": True, "move_kernel": True},
+    {"rules": "draw1"},
+    {"rules": "draw3-2redeals"},
+    {"rules": "draw1-0redeals"},
+    {"rules": "foundation-to-tableau"},
+    {"rules": "foundation-to-tableau", "move_kernel": True},
+]
+
+
+def reference_moves(game):
+    # every move of the current position, rebuilt from the piles with the
+    # string based rule checks; get_valid_moves must have flipped the tops
+    side = game.deck.getFirstSideCard()
+    can_stack = lambda higher, lower: Game.checkCardOrder(game, higher, lower)
+    moves = []
+    for i, pile in enumerate(game.playPiles):
+        if len(pile.cards) > 0 and Game.can_add_to_block(game, pile.cards[-1]):
+            moves.append((TO_BLOCK, i, -1))
+    if Game.can_add_to_block(game, side):
+        moves.append((TO_BLOCK, -1, -1))
+    for i, pile in enumerate(game.playPiles):
+        if len(pile.cards) == 0:
+            for j, pile2 in enumerate(game.playPiles):
+                if len(pile2.cards) > 1 and pile2.cards[-1].value == "K":
+                    moves.append((TO_PILE, j, i))
+            if side is not None and side.value == "K":
+                moves.append((TO_PILE, -1, i))
+    for i, pile in enumerate(game.playPiles):
+        if len(pile.cards) > 0 and side is not None and can_stack(pile.cards[-1], side):
+            moves.append((TO_PILE, -1, i))
+    for i, pile1 in enumerate(game.playPiles):
+        run = pile1.getFlippedCards()
+        for j, pile2 in enumerate(game.playPiles):
+            if i != j and len(run) > 0 and len(pile2.getFlippedCards()) > 0:
+                for n in range(1, len(run) + 1):
+                    if can_stack(pile2.cards[-1], run[-n]):
+                        moves.append((TO_PILE, i, j, n))
+    if game.rules.foundation_to_tableau:
+        for s, suit in enumerate(SUITS):
+            block = game.blockPiles[suit].cards
+            for i, pile in enumerate(game.playPiles):
+                if len(block) == 0:
+                    continue
+                if len(pile.cards) == 0:
+                    if block[-1].value == "K":
+                        moves.append((FROM_BLOCK, s, i))
+                elif can_stack(pile.cards[-1], block[-1]):
+                    moves.append((FROM_BLOCK, s, i))
+    if game.deck.can_deal():
+        moves.append((DEAL_CARDS, -1, -1))
+    return moves
+
+
+@pytest.mark.parametrize("config", CONFIGS, ids=lambda config: ",".join(
+    "{}={}".format(k, v) for k, v in config.items()) or "default")
+def test_cached_moves_match_reference(config):
+    for seed in range(20):
+        game = Game(seed=seed, **config)
+        rng = random.Random(seed)
+        for _ in range(300):
+            moves = game.get_valid_moves()
+            assert moves == reference_moves(game)
+            assert game.get_valid_moves() == moves
+            if len(moves) == 0:
+                break
+
+            r = rng.random()
+            if r < 0.02:
+                game.takeTurn()
+                continue
+            _, _, _, game_over, _, visited = game.step(moves[rng.randrange(len(moves))])
+            if game_over:
+                break
+            if visited or r < 0.1:
+                game.undo_move()
+                if r < 0.05:
+                    game.redo_move()
+
+
+def rules_trace(make_game, n_games=30, n_steps=200):
+    # digest of seeded random games: the moves offered, the step results
+    # and the state and its hash after every step, undo, redo and takeTurn
+    digest = hashlib.sha256()
+    def emit(*items):
+        digest.update(repr(items).encode())
+    for seed in range(n_games):
+        game = make_game(seed)
+        rng = random.Random(seed)
+        for _ in range(n_steps):
+            moves = game.get_valid_moves()
+            move = moves[rng.randrange(len(moves))]
+            result = game.step(move)
+            emit(moves, move, result[1:], game.state_to_str(), game.current_state())
+            emit(game.state_hash())
+            if result[3]:
+                break
+            r = rng.random()
+            if result[5] or r < 0.1:
+                game.undo_move()
+                emit(game.state_to_str())
+                emit(game.state_hash())
+                if r < 0.05:
+                    game.redo_move()
+                    emit(game.state_to_str())
+                    emit(game.state_hash())
+            elif r < 0.15:
+                emit(game.takeTurn(), game.state_to_str())
+    return digest.hexdigest()
+
+
+@pytest.mark.parametrize("compact_cards", [False, True])
+def test_rules_match_recorded_trace(compact_cards):
+    assert rules_trace(lambda seed: Game(seed=seed, compact_cards=compact_cards)) == RULES_TRACE_DIGEST
+
+
+def test_state_hash_never_merges_distinct_states():
+    # the visited sets key states by state_hash: two positions that
+    # state_to_str tells apart must never get the same hash
+    strings = {}
+    for seed in range(40):
+        game = Game(seed=seed)
+        rng = random.Random(seed)
+        for _ in range(300):
+            moves = game.get_valid_moves()
+            _, _, _, game_over, _, visited = game.step(moves[rng.randrange(len(moves))])
+            if game_over:
+                break
+            if visited and rng.random() < 0.5:
+                game.undo_move()
+            game.get_valid_moves()
+            assert strings.setdefault(game.state_hash(), game.state_to_str()) == game.state_to_str()
+
+
+def test_undo_restores_termination_counters():
+    policy = TerminationPolicy(max_streak=20)
+    counters = lambda game: (game.streak, game.stuck_deck, game.stuck_cycles, dict(policy.counts))
+    for seed in range(20):
+        game = Game(seed=seed, termination=policy)
+        rng = random.Random(seed)
+        for _ in range(300):
+            moves = game.get_valid_moves()
+            before = counters(game)
+            game_over = game.step(moves[rng.randrange(len(moves))])[3]
+            after = counters(game)
+            game.undo_move()
+            assert counters(game) == before
+            game.redo_move()
+            assert counters(game) == after
+            if game_over:
+                break
+    assert policy.counts["streak"] > 0
+
+
+def play_out(game, seed, n_steps=400):
+    # mostly greedy seeded play, undoing moves into visited states like
+    # main.play_episode: the first card that can go to a block pile 90% of
+    # the time, a random move otherwise
+    rng = random.Random(seed)
+    for _ in range(n_steps):
+        moves = game.get_valid_moves()
+        blocks = [move for move in moves if move[0] == TO_BLOCK]
+        if blocks and rng.random() < 0.9:
+            move = blocks[0]
+        else:
+            move = moves[rng.randrange(len(moves))]
+        _, _, _, game_over, win, visited = game.step(move)
+        if game_over:
+            return win
+        if visited:
+            game.undo_move()
+    return False
+
+
+def test_termination_keeps_every_win():
+    # the games given up as stuck must be lost ones
+    policy = TerminationPolicy()
+    wins = 0
+    for seed in range(100):
+        win = play_out(Game(seed=seed), seed)
+        assert play_out(Game(seed=seed, termination=policy), seed) == win, seed
+        wins += win
+    assert wins > 0 and sum(policy.counts.values()) > 0
+
+
+def test_move_kernel_deals_the_same_game():
+    # kernels is imported by the first Game(move_kernel=True)
+    sys.modules.pop("kernels", None)
+    random.seed(0)
+    kernel_game = Game(move_kernel=True)
+    random.seed(0)
+    game = Game()
+    assert kernel_game.state_to_str() == game.state_to_str()
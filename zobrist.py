@@ -0,0 +1,123 @@
+import math
+import random
+
+# 64-bit Zobrist keys for hashing game states. The generator is seeded so
+# that hashes are stable between runs and processes.
+
+MASK = (1 << 64) - 1
+N_CARDS = 52
+MAX_DEPTH = 52 # position of a card counted from the bottom of its pile
+N_SLOTS = 16 # play piles + block piles
+
+_rng = random.Random(0x5017a1e)
+
+def _key():
+    return _rng.getrandbits(64)
+
+# play/block piles: face-up cards are keyed by card and depth, face-down
+# cards by depth only (they are hidden, just like in Pile.__str__)
+FACE_UP = [[_key() for _ in range(MAX_DEPTH)] for _ in range(N_CARDS)]
+FACE_DOWN = [_key() for _ in range(MAX_DEPTH)]
+
+# odd multipliers mixing a pile hash with the slot the pile sits in
+SLOT = [_key() | 1 for _ in range(N_SLOTS)]
+
+# deck: polynomial hash over the card order, so that popping the first card
+# and appending at the end are O(1) updates
+DECK = [_key() for _ in range(N_CARDS)]
+BASE = _key() | 1
+BASE_INV = pow(BASE, -1, 1 << 64)
+BASE_POW = [pow(BASE, i, 1 << 64) for i in range(N_CARDS + 1)]
+
+# side pile: keyed by card and position from the bottom
+SIDE = [[_key() for _ in range(N_CARDS)] for _ in range(N_CARDS)]
+
+# exact canonical hashes tag a pile that still has face-down cards with its
+# bottom card: it tells which column of the deal the hidden cards come from
+COLUMN = [_key() for _ in range(N_CARDS)]
+
+# card code relabelings swapping suits of the same color (suits are
+# ordered black, red, black, red, see solitaire.SUITS): identity, swap the
+# blacks, swap the reds, swap both
+SUIT_SWAPS = [
+    [perm[code // 13] * 13 + code % 13 for code in range(N_CARDS)]
+    for perm in ([0, 1, 2, 3], [2, 1, 0, 3], [0, 3, 2, 1], [2, 3, 0, 1])
+]
+
+
+def card_key(card, depth):
+    if card.flipped:
+        return FACE_UP[card.code][depth]
+    return FACE_DOWN[depth]
+
+def mix(h):
+    # bijective 64-bit finalizer (splitmix64). Summing mixed pile hashes
+    # gives a hash of the multiset of piles, whatever their order; plain XOR
+    # would cancel out equal piles
+    h = (h + 0x9e3779b97f4a7c15) & MASK
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & MASK
+    return h ^ (h >> 31)
+
+def cards_hash(cards, bottom_depth):
+    # cards are listed bottom first, cards[0] sitting at bottom_depth
+    h = 0
+    for i, card in enumerate(cards):
+        h ^= card_key(card, bottom_depth + i)
+    return h
+
+def pile_hash(cards, relabel=None):
+    # relabel: one of SUIT_SWAPS, to hash the cards as if their suits were swapped
+    if relabel is None:
+        return cards_hash(cards, 0)
+    h = 0
+    for depth, card in enumerate(cards):
+        h ^= FACE_UP[relabel[card.code]][depth] if card.flipped else FACE_DOWN[depth]
+    return h
+
+def slot_hash(h, slot):
+    return (h * SLOT[slot]) & MASK
+
+def deck_hash(cards, relabel=None):
+    h = 0
+    for i, card in enumerate(cards):
+        h += DECK[card.code if relabel is None else relabel[card.code]] * BASE_POW[i]
+    return h & MASK
+
+def side_hash(cards, relabel=None):
+    h = 0
+    for i, card in enumerate(cards):
+        h ^= SIDE[card.code if relabel is None else relabel[card.code]][i]
+    return h
+
+
+class BloomFilter:
+    # fixed-size set of 64-bit keys with a bounded false positive rate
+
+    def __init__(self, capacity=100000, fp_rate=1e-4):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.n_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2)**2)))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def _indices(self, key):
+        h1 = key & 0xffffffff
+        h2 = (key >> 32) | 1
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % self.n_bits
+
+    def add(self, key):
+        for idx in self._indices(key):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for idx in self._indices(key):
+            if not self.bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count